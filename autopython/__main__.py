@@ -8,7 +8,23 @@ import os.path
 import sys
 
 from autopython import Presenter, VERSION
-from autopython.cpython import PresenterShell
+
+
+def duration(text):
+    value = text.strip().lower()
+    scale = 1.0
+    if value.endswith('ms'):
+        value, scale = value[:-2], 0.001
+    elif value.endswith('s'):
+        value = value[:-1]
+    try:
+        seconds = float(value) * scale
+    except ValueError:
+        seconds = 0
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError('invalid duration: ' + repr(text))
+    return seconds
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -22,6 +38,33 @@ def main():
     parser.add_argument('-d', '--delay', type=int, default=30,
                         help='Delay (in ms) between every simulated '
                              'keystroke.')
+    parser.add_argument('--max-type-time', type=duration, default=None,
+                        metavar='TIME',
+                        help='Type faster the statements that would take '
+                             'longer than TIME (in s, or ms with that suffix) '
+                             'to type.')
+    parser.add_argument('--accelerate', default=False, action='store_true',
+                        help='Type every line of a statement faster than the '
+                             'previous one.')
+    parser.add_argument('--worker', default=False, action='store_true',
+                        help='Execute the statements in a separate process, '
+                             'restarted if a statement interrupted with '
+                             'Ctrl-C doesn\'t stop.')
+    parser.add_argument('--timeout', type=duration, default=None,
+                        metavar='TIME',
+                        help='Interrupt the statements running longer than '
+                             'TIME (in s, or ms with that suffix). Implies '
+                             '--worker.')
+    parser.add_argument('--output-lines', type=int, default=None, metavar='N',
+                        help='Show at most N lines of the output of a '
+                             'statement (as many as fit in the terminal by '
+                             'default), and the rest pressing Next. 0 shows '
+                             'all of it.')
+    parser.add_argument('--output-chars', type=int, default=None,
+                        metavar='N',
+                        help='Show at most N characters of the output of a '
+                             'statement (65536 by default), like '
+                             '--output-lines.')
     parser.add_argument('-l', '--lines', type=int, default=1,
                         help='How many lines are kept after pagination.')
     parser.add_argument('--no-log', dest='logging', default=True,
@@ -33,6 +76,27 @@ def main():
     parser.add_argument('--no-pagination', dest='pagination', default=True,
                         action='store_false',
                         help='Disable code pagination.')
+    parser.add_argument('--no-cache', dest='cache', default=True,
+                        action='store_false',
+                        help="Don't cache the parsed script on disk.")
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory where parsed scripts are cached.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Compile the script using that many processes.')
+    parser.add_argument('--code-cache', type=int, default=None, metavar='N',
+                        help='Compile statements only when needed, keeping '
+                             'at most N of them compiled.')
+    parser.add_argument('--checkpoints', type=int, default=None, metavar='N',
+                        help='Keep a copy of the session (on systems with '
+                             'fork) every N statements and before every ## '
+                             'comment, so going back restarts from there.')
+    parser.add_argument('--speculate', default=False, action='store_true',
+                        help='Execute every statement (on systems with fork) '
+                             'while it\'s typed, showing its output once '
+                             'executed, but those with a "no-speculate" '
+                             'comment or reading input.')
+    parser.add_argument('-w', '--watch', default=False, action='store_true',
+                        help='Reload the script when it changes.')
     parser.add_argument('SOURCE')
     args = parser.parse_args()
 
@@ -44,11 +108,24 @@ def main():
             sys.exit(1)
         args.SOURCE += '.py'
 
+    # The shell is imported only now to start faster on --help or --version.
+    from autopython.cpython import PresenterShell
     color_scheme = args.color_scheme if args.highlight else None
-    shell = PresenterShell(color_scheme=color_scheme, use_ipython=args.ipython)
+    shell = PresenterShell(color_scheme=color_scheme, use_ipython=args.ipython,
+                           use_worker=args.worker or args.timeout is not None,
+                           timeout=args.timeout,
+                           max_output_lines=args.output_lines,
+                           max_output_chars=args.output_chars)
 
     presenter = Presenter(shell, logging=args.logging, context_lines=args.lines,
-                          paginate=args.pagination, typing_delay=args.delay)
+                          paginate=args.pagination, typing_delay=args.delay,
+                          use_cache=args.cache, cache_dir=args.cache_dir,
+                          jobs=args.jobs, code_cache_size=args.code_cache,
+                          watch=args.watch,
+                          max_typing_time=args.max_type_time,
+                          accelerate=args.accelerate,
+                          checkpoint_interval=args.checkpoints,
+                          speculate=args.speculate)
     try:
         presenter.load_file(args.SOURCE)
     except OSError as exc:
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import array
+import hashlib
+import marshal
+import os
+import sys
+
+from . import parser
+
+CACHE_SUFFIX = '.apc'
+MAX_CACHE_SIZE = 64 * 1024 * 1024
+# Changed whenever what's stored in the cache changes.
+CACHE_FORMAT = 3
+
+
+def default_cache_dir():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'autopython')
+
+
+def cache_key(source, lazy=False):
+    # Anything changing how a script is parsed or compiled must be here.
+    from . import VERSION
+    key = hashlib.sha1(source)
+    for value in (CACHE_FORMAT, VERSION, sys.version, marshal.version,
+                  sys.stdout.encoding, sys.stdin.encoding, lazy):
+        key.update(repr(value).encode('utf-8'))
+    return key.hexdigest()
+
+
+def parse_file(filename, cache_dir=None, max_size=MAX_CACHE_SIZE,
+               stream=False, jobs=1, code_cache_size=None):
+    """
+    Return the statements of the given script like `parser.parse_file`,
+    reusing the ones cached from a previous run whenever the script, the
+    interpreter and AutoPython are the same.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    with parser.open_source(filename) as source:
+        key = cache_key(source, code_cache_size is not None)
+        cache_name = os.path.join(cache_dir, key + CACHE_SUFFIX)
+        table = load_statements(cache_name, code_cache_size)
+        if table is not None:
+            return table
+        source_lines = parser.decode_source(source)
+
+    def store(table):
+        if store_statements(cache_name, table):
+            evict(cache_dir, max_size, keep=cache_name)
+    return parser.parse_source_lines(source_lines, stream, jobs, store,
+                                     code_cache_size)
+
+
+def load_statements(cache_name, code_cache_size=None):
+    try:
+        with open(cache_name, 'rb') as cache_file:
+            source, line_number, columns, codes = marshal.load(cache_file)
+        table = parser.StatementTable(code_cache_size=code_cache_size)
+        table.source = source
+        table.base_line_number = line_number
+        for name, values in zip(parser.StatementTable.COLUMNS, columns):
+            column = getattr(table, name)
+            setattr(table, name, array.array(column.typecode, values))
+        table.codes = codes
+        os.utime(cache_name, None)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    return table
+
+
+def store_statements(cache_name, table):
+    import tempfile
+    columns = [getattr(table, name).tolist()
+               for name in parser.StatementTable.COLUMNS]
+    cache_dir = os.path.dirname(cache_name)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, temp_name = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as cache_file:
+                marshal.dump((table.source, table.base_line_number, columns,
+                              table.codes), cache_file)
+            _replace(temp_name, cache_name)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+    except (IOError, OSError, ValueError):
+        return False
+    return True
+
+
+def evict(cache_dir, max_size=MAX_CACHE_SIZE, keep=None):
+    """Remove the least recently used entries until the cache fits."""
+    entries = []
+    total_size = 0
+    try:
+        for name in os.listdir(cache_dir):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+    except (IOError, OSError):
+        return
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total_size -= size
+        except (IOError, OSError):
+            pass
+
+
+if hasattr(os, 'replace'):
+    _replace = os.replace
+elif os.name == 'nt':
+    def _replace(src, dst):
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+else:
+    _replace = os.rename
+
+
+__all__ = ['default_cache_dir', 'cache_key', 'parse_file', 'load_statements',
+           'store_statements', 'evict']
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+import array
+import os
+import signal
+import socket
+
+MAX_CHECKPOINTS = 64
+# Sent instead of a statement index by `Checkpoints.detach`, and to a
+# forked process by `Checkpoints.hand_over`, which may also send the
+# connection to the process to the parent (where it's possible).
+DETACH = -1
+COMMIT = -2
+HANDED_OVER = -3
+CAN_SEND_CONNECTIONS = hasattr(socket, 'SCM_RIGHTS') and \
+    hasattr(socket.socket, 'sendmsg')
+
+
+class Checkpoint(object):
+    def __init__(self, index, pid, connection):
+        self.index = index
+        self.pid = pid
+        self.connection = connection
+
+
+class CheckpointResumed(Exception):
+    def __init__(self, target):
+        Exception.__init__(self, target)
+        self.target = target
+
+
+class Checkpoints(object):
+    """
+    Frozen copies of the process (made with fork, so memory is shared until
+    changed) taken after executing some statement, so going back to a later
+    one only needs to execute the statements after it.
+
+    A copy is resumed by telling it where to go. Meanwhile, the process
+    resuming it waits until the presentation ends (to end too) or until the
+    copy needs to go back before where it was taken, then continuing itself.
+    """
+    def __init__(self):
+        self._checkpoints = []
+        self._parent = None
+        self._detached = False
+
+    @staticmethod
+    def available():
+        return hasattr(os, 'fork')
+
+    def __contains__(self, index):
+        return any(c.index == index for c in self._checkpoints)
+
+    def take(self, index):
+        """
+        Make a frozen copy of the process after executing `index` statements.
+
+        Return None, but in the copy once it's resumed, where the statement to
+        go to is returned. The resumed copy keeps a new copy of itself.
+        """
+        target = None
+        while True:
+            checkpoint = self.fork(index)
+            if checkpoint is not None:
+                self._checkpoints.append(checkpoint)
+                if len(self._checkpoints) > MAX_CHECKPOINTS:
+                    self._remove(self._checkpoints[0])
+                return target
+            target = _receive(self._parent)
+            if target is None:
+                # The presentation ended
+                os._exit(0)
+
+    def fork(self, index=None):
+        """
+        Fork a process that may continue the presentation in place of this
+        one (see `hand_over`). Return it as a Checkpoint, or None in the
+        forked process.
+        """
+        connection, child_connection = socket.socketpair()
+        pid = os.fork()
+        if pid:
+            child_connection.close()
+            return Checkpoint(index, pid, connection)
+
+        # The checkpoints belong to the parent.
+        connection.close()
+        for checkpoint in self._checkpoints:
+            checkpoint.connection.close()
+        self._checkpoints = []
+        if self._parent is not None:
+            self._parent.close()
+        self._parent = child_connection
+        self._detached = False
+        return None
+
+    def wait_for_hand_over(self):
+        """
+        In a forked process, wait until the parent hands the presentation
+        over to it, returning False if it was dropped instead.
+        """
+        return _receive(self._parent) == COMMIT
+
+    def hand_over(self, process):
+        """
+        Let a forked process continue the presentation (it gets SIGUSR1 in
+        case it's busy), and wait like when it's resumed by `go_back`.
+
+        Return the statement this process has to go back to, if it has to
+        continue instead.
+        """
+        _send(process.connection, COMMIT)
+        os.kill(process.pid, signal.SIGUSR1)
+        if not self._checkpoints and self._parent is not None and \
+                not self._detached and CAN_SEND_CONNECTIONS:
+            # There's nothing to go back to in this process, so the parent
+            # waits for the forked one instead.
+            _send(self._parent, HANDED_OVER, process.pid,
+                  fd=process.connection.fileno())
+            os._exit(0)
+        return self._wait_for(process)
+
+    def drop(self, process):
+        """Kill a forked process."""
+        process.connection.close()
+        os.kill(process.pid, signal.SIGKILL)
+        os.waitpid(process.pid, 0)
+
+    def go_back(self, target):
+        """
+        Continue from the checkpoint nearest to (but not after) `target`.
+
+        Return the statement this process has to go back to by itself, since
+        there's no checkpoint before it. That may be a different one than the
+        given if a copy resumed had to go back further.
+        """
+        while True:
+            candidates = [c for c in self._checkpoints if c.index <= target]
+            if not candidates:
+                if self._parent is None or self._detached:
+                    return target
+                _send(self._parent, target)
+                os._exit(0)
+            checkpoint = max(candidates, key=lambda c: c.index)
+            self._checkpoints.remove(checkpoint)
+            _send(checkpoint.connection, target)
+            target = self._wait_for(checkpoint)
+
+    def _wait_for(self, process):
+        # Return where the process continuing the presentation needs to go
+        # back to, ending along with it if the presentation ends.
+        while True:
+            message, fds = _receive_message(process.connection)
+            target = message and message[0]
+            if target == DETACH:
+                self.detach()
+            elif target == HANDED_OVER:
+                _reap(process.pid)
+                process.connection.close()
+                connection = socket.fromfd(fds[0], socket.AF_UNIX,
+                                           socket.SOCK_STREAM)
+                os.close(fds[0])
+                process = Checkpoint(process.index, message[1], connection)
+            else:
+                break
+        status = _reap(process.pid)
+        process.connection.close()
+        if target is None:
+            # The presentation ended in the other process.
+            self.discard()
+            os._exit(os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1)
+        return target
+
+    def discard(self):
+        """Remove every checkpoint."""
+        for checkpoint in list(self._checkpoints):
+            self._remove(checkpoint)
+
+    def detach(self):
+        """
+        Remove every checkpoint, including those of the processes waiting
+        for this one, which won't be resumed anymore.
+        """
+        self.discard()
+        if self._parent is not None and not self._detached:
+            _send(self._parent, DETACH)
+            self._detached = True
+
+    def _remove(self, checkpoint):
+        self._checkpoints.remove(checkpoint)
+        checkpoint.connection.close()
+        os.waitpid(checkpoint.pid, 0)
+
+
+def _reap(pid):
+    # Return the exit status of the process, or 0 if it isn't a child since
+    # it was handed over.
+    try:
+        return os.waitpid(pid, 0)[1]
+    except OSError:
+        return 0
+
+
+def _send(connection, *numbers, **kwargs):
+    # Every message is a line of numbers, maybe along with a file descriptor.
+    data = ' '.join(str(n) for n in numbers).encode('ascii') + b'\n'
+    fd = kwargs.get('fd')
+    if fd is None:
+        connection.sendall(data)
+    else:
+        connection.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                     array.array('i', [fd]))])
+
+
+def _receive(connection):
+    message, _ = _receive_message(connection)
+    return message and message[0]
+
+
+def _receive_message(connection):
+    # Return the numbers of the message, or None if the other process closed
+    # the connection, and the file descriptors received. The message is read
+    # a byte at a time, not to read the next one. Ctrl-C is ignored while
+    # waiting, since it's meant for the active process.
+    previous_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    data = b''
+    fds = array.array('i')
+    try:
+        while not data.endswith(b'\n'):
+            if CAN_SEND_CONNECTIONS:
+                chunk, ancillary, _, _ = connection.recvmsg(
+                    1, socket.CMSG_SPACE(fds.itemsize))
+                for level, kind, fd_data in ancillary:
+                    if level == socket.SOL_SOCKET and \
+                            kind == socket.SCM_RIGHTS:
+                        fds.frombytes(fd_data[:len(fd_data) -
+                                              len(fd_data) % fds.itemsize])
+            else:
+                chunk = connection.recv(1)
+            if not chunk:
+                return None, list(fds)
+            data += chunk
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+    return [int(n) for n in data.split()], list(fds)
+
+
+__all__ = ['Checkpoints', 'CheckpointResumed']
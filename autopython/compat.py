@@ -3,6 +3,7 @@
 from __future__ import print_function
 
 import sys
+import time
 
 try:
     import queue
@@ -38,4 +39,10 @@ else:
     from io import StringIO
 
 
-__all__ = ['PY2', 'PY3', 'input', 'print', 'queue', 'StringIO']
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    monotonic = time.time
+
+
+__all__ = ['PY2', 'PY3', 'input', 'monotonic', 'print', 'queue', 'StringIO']
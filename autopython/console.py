@@ -4,10 +4,13 @@
 # Author:  anatoly techtonik <techtonik@gmail.com>
 # License: Public Domain (use MIT if the former doesn't work for you)
 
+import codecs
 import os
+import signal
 import sys
 
-from collections import namedtuple
+from collections import deque, namedtuple
+from contextlib import contextmanager
 
 terminal_size = namedtuple("terminal_size", "columns lines")
 
@@ -56,6 +59,8 @@ if os.name == 'nt':
 
     import msvcrt
 
+    _kbhit = msvcrt.kbhit
+
     def _getch():
         ch1 = msvcrt.getwch()
         if ch1 == u'\x00' or ch1 == u'\xe0':
@@ -63,10 +68,13 @@ if os.name == 'nt':
             return [ch1, ch2]
         return ch1
 
-    def enable_echo():
+    def _read_keys():
+        return [_getch()]
+
+    def _enable_echo():
         pass
 
-    def disable_echo():
+    def _disable_echo():
         pass
 
     ESC = u'\x1b'
@@ -81,6 +89,7 @@ if os.name == 'nt':
 elif os.name == 'posix':
     import array
     import fcntl
+    import select
     import termios
     import tty
 
@@ -120,7 +129,8 @@ elif os.name == 'posix':
             #
             # tty.setcbreak() is just a helper for tcsetattr() call, see
             # http://hg.python.org/cpython/file/c6880edaf6f3/Lib/tty.py
-            tty.setcbreak(fd)
+            # (without discarding the keys already pressed)
+            tty.setcbreak(fd, termios.TCSANOW)
             ch1 = sys.stdin.read(1)
 
             # clear input buffer placing all available chars into morech
@@ -147,16 +157,27 @@ elif os.name == 'posix':
 
         return ch1
 
-    def enable_echo():
+    def _read_keys():
+        decoder = KeyDecoder()
+        return decoder.feed(''.join(_getch())) + decoder.flush()
+
+    def _kbhit():
+        return bool(select.select([sys.stdin], [], [], 0)[0])
+
+    def _enable_echo():
         fd = sys.stdin.fileno()
         attrs = termios.tcgetattr(fd)
-        attrs[3] = attrs[3] | termios.ECHO
+        attrs[3] = attrs[3] | termios.ECHO | termios.ICANON
         termios.tcsetattr(fd, termios.TCSADRAIN, attrs)
 
-    def disable_echo():
+    def _disable_echo():
+        # Input isn't buffered by lines either, so keys can be checked for
+        # while echo is disabled.
         fd = sys.stdin.fileno()
         attrs = termios.tcgetattr(fd)
-        attrs[3] = attrs[3] & ~termios.ECHO
+        attrs[3] = attrs[3] & ~(termios.ECHO | termios.ICANON)
+        attrs[6][termios.VMIN] = 1
+        attrs[6][termios.VTIME] = 0
         termios.tcsetattr(fd, termios.TCSADRAIN, attrs)
 
     ESC = '\x1b'
@@ -173,6 +194,35 @@ else:
     raise ImportError("platform not supported")
 
 
+_terminal_size = None
+_resize_count = 0
+_previous_resize_handler = None
+_watching_resizes = False
+
+
+def _resized(signum, frame):
+    global _terminal_size, _resize_count
+    _terminal_size = None
+    _resize_count += 1
+    if callable(_previous_resize_handler):
+        _previous_resize_handler(signum, frame)
+
+
+def _watch_resizes():
+    # The size can be cached only if we're told when it changes.
+    global _previous_resize_handler, _watching_resizes
+    if not _watching_resizes and hasattr(signal, 'SIGWINCH'):
+        try:
+            _previous_resize_handler = signal.signal(signal.SIGWINCH,
+                                                     _resized)
+        except ValueError:
+            # Not in the main thread
+            return False
+        signal.siginterrupt(signal.SIGWINCH, False)
+        _watching_resizes = True
+    return _watching_resizes
+
+
 def get_terminal_size(fallback=(80, 24)):
     """
     Return the size of the terminal window (in characters).
@@ -185,20 +235,272 @@ def get_terminal_size(fallback=(80, 24)):
     size used by many terminal emulators.
 
     Windows part uses console API through ctypes module.
-    *nix part uses termios ioctl TIOCGWINSZ call.
+    *nix part uses termios ioctl TIOCGWINSZ call, and the size is cached
+    until the terminal is resized (SIGWINCH).
     """
-    size = _get_terminal_size()
+    global _terminal_size
+    size = _terminal_size
+    if size is None:
+        watching = _watch_resizes()
+        resize_count = _resize_count
+        size = _get_terminal_size()
+        if watching and resize_count == _resize_count:
+            _terminal_size = size
     return terminal_size(size[0] or fallback[0], size[1] or fallback[1])
 
 
+class BufferedWriter(object):
+    """
+    Collect the text written to a stream (the standard output by default)
+    and send it with a single write call when flushed.
+    """
+    def __init__(self, stream=None):
+        self._stream = sys.stdout if stream is None else stream
+        self._buffer = []
+        self._fd = None
+        # colorama replaces the standard output on Windows to translate
+        # escape sequences, so it must be written through it.
+        if os.name != 'nt':
+            try:
+                self._fd = self._stream.fileno()
+            except (AttributeError, IOError, ValueError):
+                pass
+        self._encoding = getattr(self._stream, 'encoding', None) or 'utf-8'
+
+    def write(self, text):
+        self._buffer.append(text)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        text = ''.join(self._buffer)
+        del self._buffer[:]
+        if self._fd is None:
+            self._stream.write(text)
+            self._stream.flush()
+            return
+        self._stream.flush()
+        data = text.encode(self._encoding, 'replace')
+        while data:
+            written = os.write(self._fd, data)
+            data = data[written:]
+
+
+# How long to wait for the rest of an escape sequence before taking the
+# characters read as separate keys.
+ESCAPE_TIMEOUT = 0.05
+
+
+class KeyDecoder(object):
+    """
+    Split the characters read from the terminal into keys, keeping together
+    the escape sequences generated by special keys (as lists).
+    """
+    def __init__(self):
+        self._pending = ''
+
+    @property
+    def incomplete(self):
+        return bool(self._pending)
+
+    def feed(self, text):
+        text = self._pending + text
+        self._pending = ''
+        keys = []
+        start = 0
+        while start < len(text):
+            if text[start] != ESC:
+                keys.append(text[start])
+                start += 1
+                continue
+            end = _escape_sequence_end(text, start)
+            if end is None:
+                self._pending = text[start:]
+                break
+            key = text[start:end]
+            keys.append(key if len(key) == 1 else list(key))
+            start = end
+        return keys
+
+    def flush(self):
+        # The rest of the sequence isn't coming, so Esc was pressed.
+        pending, self._pending = self._pending, ''
+        if not pending:
+            return []
+        return [pending[0]] + self.feed(pending[1:]) + self.flush()
+
+
+def _escape_sequence_end(text, start):
+    # Return None if the sequence may continue after the text.
+    if start + 1 == len(text):
+        return None
+    kind = text[start + 1]
+    if kind == '[':
+        end = start + 2
+        while end < len(text) and u'\x20' <= text[end] <= u'\x3f':
+            end += 1
+        return end + 1 if end < len(text) else None
+    elif kind == 'O':
+        return start + 3 if start + 2 < len(text) else None
+    elif kind == ESC:
+        return start + 1
+    return start + 2
+
+
+class TerminalSession(object):
+    """
+    Context manager keeping the terminal in cbreak mode without echo, so
+    every key is read with a single call while it's active, instead of
+    changing the terminal settings for every key.
+    """
+    def __init__(self):
+        self._fd = None
+        self._settings = None
+        self._decoder = None
+        self._keys = KeyDecoder()
+
+    def __enter__(self):
+        global _session
+        if os.name == 'posix' and _session is None and sys.stdin.isatty():
+            self._fd = sys.stdin.fileno()
+            self._settings = termios.tcgetattr(self._fd)
+            encoding = getattr(sys.stdin, 'encoding', None) or 'utf-8'
+            self._decoder = codecs.getincrementaldecoder(encoding)('replace')
+            tty.setcbreak(self._fd, termios.TCSANOW)
+            _session = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _session
+        if _session is self:
+            _session = None
+            termios.tcsetattr(self._fd, termios.TCSADRAIN, self._settings)
+
+    @contextmanager
+    def suspended(self):
+        # The terminal works as usual meanwhile.
+        termios.tcsetattr(self._fd, termios.TCSADRAIN, self._settings)
+        try:
+            yield
+        finally:
+            tty.setcbreak(self._fd, termios.TCSANOW)
+
+    def discard_keys(self):
+        self._keys = KeyDecoder()
+
+    def key_pressed(self):
+        return self._keys.incomplete or \
+            bool(select.select([self._fd], [], [], 0)[0])
+
+    def read_keys(self):
+        # Read all the keys pressed, waiting for one if there's none.
+        while True:
+            if self._keys.incomplete:
+                ready = select.select([self._fd], [], [], ESCAPE_TIMEOUT)[0]
+                if not ready:
+                    return self._keys.flush()
+            data = os.read(self._fd, 1024)
+            if not data:
+                return self._keys.flush() or ['']
+            keys = self._keys.feed(self._decoder.decode(data))
+            if keys:
+                return keys
+
+
+_session = None
+# Keys read but not returned yet by getch.
+_pending_keys = deque()
+
+
+@contextmanager
+def suspend_session():
+    """Restore the usual terminal settings while in a `TerminalSession`."""
+    if _session is None:
+        yield
+    else:
+        with _session.suspended():
+            yield
+
+
+@contextmanager
+def redirect_output(output):
+    """
+    Write the standard output and error to the file `output` meanwhile, even
+    from outside Python, and read the standard input from nowhere.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(fd) for fd in (0, 1, 2)]
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.close(null_fd)
+    os.dup2(output.fileno(), 1)
+    os.dup2(output.fileno(), 2)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved_fd in enumerate(saved_fds):
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+
+
+@contextmanager
+def discard_output():
+    """Like `redirect_output`, but writing nowhere."""
+    with open(os.devnull, 'wb') as output:
+        with redirect_output(output):
+            yield
+
+
 def getch():
     """
     Wait for keypress, return character or a list of characters.
 
-    Arrows and special keys generate a sequence of characters, so if there are
-    extra symbols in input buffer, this function returns list.
+    Arrows and special keys generate a sequence of characters, returned as a
+    list. When several keys were pressed, they are returned one at a time.
     """
-    return _getch()
+    while not _pending_keys:
+        if _session is not None:
+            _pending_keys.extend(_session.read_keys())
+        else:
+            _pending_keys.extend(_read_keys())
+    return _pending_keys.popleft()
+
+
+def kbhit():
+    """Return whether a key was pressed, so `getch` won't wait."""
+    if _pending_keys:
+        return True
+    if _session is not None:
+        return _session.key_pressed()
+    return _kbhit()
+
+
+def enable_echo():
+    if _session is None:
+        _enable_echo()
+
+
+def disable_echo():
+    if _session is None:
+        _disable_echo()
+
+
+def discard_keys():
+    """Forget the keys pressed but not read yet by `getch`."""
+    _pending_keys.clear()
+    if _session is not None:
+        _session.discard_keys()
+
+
+def ungetch(key):
+    """Make `getch` return the given key before reading any other."""
+    _pending_keys.appendleft(key)
 
 
-__all__ = ['get_terminal_size', 'enable_echo', 'disable_echo', 'getch']
+__all__ = ['get_terminal_size', 'enable_echo', 'disable_echo', 'getch',
+           'kbhit', 'ungetch', 'discard_keys', 'BufferedWriter',
+           'KeyDecoder', 'TerminalSession', 'redirect_output',
+           'discard_output', 'suspend_session']
@@ -5,12 +5,14 @@ from __future__ import print_function
 import sys
 
 from code import InteractiveInterpreter
-from threading import Thread
-from .compat import PY2, input, print, queue, StringIO
-from .highlighter import HAVE_HIGHLIGHTING, highlight, ansiformat, Token
-from .highlighter import TerminalFormatter, get_color_for, COLOR_SCHEMES
-from .highlighter import Python3Lexer, TracebackLexer, LineLexer
-from .interactions import layout_code, simulate_typing, ask_index
+from threading import Lock, Thread
+from .compat import PY2, input, print, queue
+from .console import discard_output
+from .highlighter import Token, colorize, format_tokens, get_color_table
+from .highlighter import get_lexer, get_traceback_lexer, load_highlighting
+from .interactions import _tokenize, layout_code, simulate_typing, ask_index
+from .interactions import TypingSchedule, count_typed_chars
+from .pager import OutputPager
 
 
 class PresenterInterpreter(InteractiveInterpreter):
@@ -25,28 +27,29 @@ class PresenterInterpreter(InteractiveInterpreter):
 
 class HighlightingInterpreter(PresenterInterpreter):
     def __init__(self, *args, **kwargs):
-        scheme = COLOR_SCHEMES.get(kwargs.pop('color_scheme', 'default'), {})
+        color_scheme = kwargs.pop('color_scheme', 'default')
         PresenterInterpreter.__init__(self, *args, **kwargs)
-        self._lexer = TracebackLexer()
-        colors = {token: (color, color) for token, color in scheme.items()}
-        self._formatter = TerminalFormatter(colorscheme=colors)
-
-    def highlight_error(self, method, *args, **kwargs):
-        new_stderr = StringIO()
-        old_stderr, sys.stderr = sys.stderr, new_stderr
-        try:
-            method(self, *args, **kwargs)
-        finally:
-            sys.stderr = old_stderr
-        output = new_stderr.getvalue()
-        print(end=highlight(output, self._lexer, self._formatter),
-              file=sys.stderr, flush=True)
-
-    def showtraceback(self):
-        self.highlight_error(PresenterInterpreter.showtraceback)
-
-    def showsyntaxerror(self, filename=None):
-        self.highlight_error(PresenterInterpreter.showsyntaxerror, filename)
+        self._lexer = get_traceback_lexer()
+        self._color_table = get_color_table(color_scheme)
+
+    def write(self, data):
+        # Tracebacks and syntax errors are written here as the standard error
+        # would get them, but highlighted. They're written a line at a time
+        # as they're lexed, and once the output is kept to be shown later
+        # (see OutputPager), the rest as it is.
+        line = []
+        for position, ttype, text in self._lexer.get_tokens_unprocessed(
+                data):
+            line.append((ttype, text))
+            if '\n' in text:
+                sys.stderr.write(format_tokens(line, self._color_table))
+                line = []
+                if getattr(sys.stderr, 'overflowing', False):
+                    sys.stderr.write(data[position + len(text):])
+                    break
+        else:
+            sys.stderr.write(format_tokens(line, self._color_table))
+        sys.stderr.flush()
 
 
 class Quitter(object):
@@ -64,27 +67,183 @@ class Quitter(object):
         return repr(self.__func)
 
 
+def make_interpreter(shell, color_scheme=None):
+    # `exit()` and `quit()` only leave the interactive mode of the shell.
+    ns = {'exit': Quitter(shell, exit), 'quit': Quitter(shell, quit)}
+    if color_scheme and load_highlighting():
+        return HighlightingInterpreter(color_scheme=color_scheme, locals=ns)
+    return PresenterInterpreter(locals=ns)
+
+
+def enable_completion(namespace):
+    # readline is only needed when interacting.
+    try:
+        import readline
+    except ImportError:
+        try:
+            import pyreadline as readline
+        except ImportError:
+            return
+    import rlcompleter
+    completer = rlcompleter.Completer(namespace)
+    readline.set_completer(completer.complete)
+    readline.parse_and_bind("tab: complete")
+
+
+def interact_with(interpreter, shell, ps1, ps2,
+                  interrupted='KeyboardInterrupt'):
+    # Execute the statements entered until EOF or until `shell._interacting`
+    # becomes False, yielding the lines of every one of them.
+    lines = []
+    need_more = False
+    print(end='\r', flush=True)
+    while shell._interacting:
+        try:
+            try:
+                line = input(ps2 if need_more else ps1)
+                if PY2:
+                    line = line.decode(sys.stdin.encoding)
+                lines.append(line)
+            except EOFError:
+                break
+            else:
+                source = '\n'.join(lines)
+                if PY2:
+                    source = source.encode(sys.stdin.encoding)
+                need_more = interpreter.runsource(source)
+                if not need_more:
+                    yield lines
+                    lines = []
+        except KeyboardInterrupt:
+            print('\n' + interrupted, flush=True)
+            lines = []
+            need_more = False
+    print(flush=True)
+
+
+class _Spares(object):
+    # Makes objects calling `factory` in the background, so the next one is
+    # ready when needed. The first one is made when asked for.
+    def __init__(self, factory):
+        self._factory = factory
+        self._ready = None
+
+    def get(self):
+        if self._ready is None:
+            item = self._factory()
+        else:
+            item, error = self._ready.get()
+            if error is not None:
+                raise error
+        self._ready = queue.Queue(1)
+        thread = Thread(target=self._make, args=(self._ready,))
+        thread.daemon = True
+        thread.start()
+        return item
+
+    def _make(self, ready):
+        try:
+            ready.put((self._factory(), None))
+        except Exception as exc:
+            ready.put((None, exc))
+
+
 class PresenterShell(object):
-    def __init__(self, color_scheme='default', use_ipython=False):
+    def __init__(self, color_scheme='default', use_ipython=False,
+                 use_worker=False, timeout=None, max_output_lines=None,
+                 max_output_chars=None):
         self._color_scheme = color_scheme
         self._use_ipython = use_ipython
         self._interpreter = None
+        self._spares = _Spares(self._make_interpreter)
+        self._pager = OutputPager(max_output_lines, max_output_chars,
+                                  color_scheme)
+        self._worker = None
+        if use_worker and not use_ipython:
+            from .worker import InterpreterProcess
+            if InterpreterProcess.available():
+                self._worker = InterpreterProcess(
+                    color_scheme, timeout, max_output_lines, max_output_chars)
         self._hl_ps1 = self._ps1 = '>>> '
         self._hl_ps2 = self._ps2 = '... '
         self._output = None
+        self._schedule = None
+        self._tokens = {}
+        self._tokens_lock = Lock()
+        self._tokenizing = 0
         if color_scheme:
-            color = get_color_for(Token.Generic.Prompt, color_scheme)
-            self._hl_ps1 = ansiformat(color, self._ps1)
-            self._hl_ps2 = ansiformat(color, self._ps2)
-            self._lexer = Python3Lexer()
-        else:
-            self._lexer = LineLexer()
+            color_on, color_off = get_color_table(color_scheme)[
+                Token.Generic.Prompt]
+            self._hl_ps1 = color_on + self._ps1 + color_off
+            self._hl_ps2 = color_on + self._ps2 + color_off
+        self._lexer = get_lexer(color_scheme)
+
+    def prepare(self, statements):
+        # Tokenize every statement in the background, so showing them doesn't
+        # wait for the lexer. Calling it again stops the previous thread, and
+        # the tokens of statements no longer in the script are forgotten
+        # once every statement is tokenized.
+        with self._tokens_lock:
+            self._tokenizing += 1
+            generation = self._tokenizing
+        lexer = type(self._lexer)()
+
+        def tokenize_all():
+            texts = []
+            while len(texts) < statements.wait_for(len(texts) + 1):
+                for statement in statements.texts(len(texts)):
+                    texts.append(statement)
+                    with self._tokens_lock:
+                        if generation != self._tokenizing:
+                            return
+                        cached = statement in self._tokens
+                    if not cached:
+                        tokens = list(_tokenize(lexer, statement))
+                        with self._tokens_lock:
+                            self._tokens[statement] = tokens
+            with self._tokens_lock:
+                if generation == self._tokenizing:
+                    self._tokens = dict((statement, self._tokens[statement])
+                                        for statement in texts
+                                        if statement in self._tokens)
+
+        thread = Thread(target=tokenize_all)
+        thread.daemon = True
+        thread.start()
+
+    def supports_forking(self):
+        # IPython runs threads and keeps its history in a database, which
+        # don't survive forking, nor does a separate process.
+        return not self._use_ipython and self._worker is None
+
+    def after_fork(self, statements):
+        # Neither the tokenizing thread nor the one making interpreters exist
+        # in the forked process.
+        self._tokens_lock = Lock()
+        self._spares = _Spares(self._make_interpreter)
+        self.prepare(statements)
+
+    def _get_tokens(self, statement):
+        with self._tokens_lock:
+            tokens = self._tokens.get(statement)
+        if tokens is None:
+            tokens = list(_tokenize(self._lexer, statement))
+            with self._tokens_lock:
+                self._tokens[statement] = tokens
+        return tokens
 
     def _colored(self, color, text):
-        return ansiformat(color, text) if self._color_scheme else text
+        return colorize(color, text) if self._color_scheme else text
+
+    def _make_interpreter(self):
+        return make_interpreter(self, self._color_scheme)
 
     def reset_interpreter(self):
-        if self._use_ipython:
+        if self._use_ipython and self._interpreter is not None:
+            # Making a new IPython shell takes long, and there can't be
+            # another one ready, since it replaces some global state.
+            self._interpreter.reset(new_session=True)
+        elif self._use_ipython:
             import IPython
             from IPython.terminal.interactiveshell import \
                 TerminalInteractiveShell
@@ -94,16 +253,16 @@ class PresenterShell(object):
                 pass
 
             self._interpreter = IPythonInterpreter(confirm_exit=False)
-            if not HAVE_HIGHLIGHTING or not self._color_scheme:
+            if not self._color_scheme or not load_highlighting():
                 self._interpreter.run_line_magic('colors', 'NoColor')
 
             interpreter = self._interpreter
-            session_id = interpreter.history_manager.session_number
             history_queue = self._history_queue = queue.Queue()
             def monitor():
                 if not self._interacting:
                     return
-                it = interpreter.history_manager.get_range(session_id, -1)
+                # Session 0 is the current one, which changes on reset.
+                it = interpreter.history_manager.get_range(0, -1)
                 last_input = next(it, None)
                 if last_input is not None:
                     history_queue.put(last_input[-1])
@@ -123,25 +282,11 @@ class PresenterShell(object):
                 self._interpreter.prompt_manager.out_template = ''
                 self._interpreter.prompt_manager.justify = False
             self._interpreter.separate_in = ''
+        elif self._worker is not None:
+            # A new process, even if the previous one is stuck.
+            self._worker.start()
         else:
-            ns = {'exit': Quitter(self, exit), 'quit': Quitter(self, quit)}
-            if HAVE_HIGHLIGHTING and self._color_scheme:
-                self._interpreter = HighlightingInterpreter(
-                    color_scheme=self._color_scheme, locals=ns)
-            else:
-                self._interpreter = PresenterInterpreter(locals=ns)
-            have_readline = True
-            try:
-                import readline
-            except ImportError:
-                try:
-                    import pyreadline as readline
-                except ImportError:
-                    have_readline = False
-            if have_readline:
-                import rlcompleter
-                readline.set_completer(rlcompleter.Completer(ns).complete)
-                readline.parse_and_bind("tab: complete")
+            self._interpreter = self._spares.get()
 
     def begin(self):
         self.reset_interpreter()
@@ -161,13 +306,23 @@ class PresenterShell(object):
             self._output = None
 
     def show(self, statement, prompts, index=None, index_line=-1,
-             typing_delay=0, paginate=False, context_lines=0):
+             typing_delay=0, paginate=False, context_lines=0,
+             max_typing_time=None, accelerate=False, skip_keys=(),
+             stop_keys=()):
         ps1 = self._hl_ps1, len(self._ps1)
         ps2 = self._hl_ps2, len(self._ps2)
         hl_prompts = (ps1 if p == 'ps1' else ps2 for p in prompts)
-        tokens = layout_code(self._lexer, statement, hl_prompts,
-                             index, index_line, context_lines)
-        output = simulate_typing(tokens, self._color_scheme, typing_delay)
+        tokens = self._get_tokens(statement)
+        self._schedule = None
+        if typing_delay:
+            self._schedule = TypingSchedule(
+                count_typed_chars(tokens, statement), typing_delay,
+                max_typing_time, accelerate)
+        # The code is laid out as it's shown, following the console size.
+        tokens = layout_code(tokens, statement, hl_prompts, index, index_line,
+                             context_lines)
+        output = simulate_typing(tokens, self._color_scheme, self._schedule,
+                                 skip_keys, stop_keys)
         if paginate:
             max_line = statement.count('\n') - 1
             for line_number, console_filled in output:
@@ -179,19 +334,80 @@ class PresenterShell(object):
                 pass
         return False
 
+    def typing_speed(self):
+        """
+        Return the characters per second achieved and requested when typing
+        the last statement shown, or None if it wasn't typed.
+        """
+        if self._schedule is None:
+            return None
+        return self._schedule.speed()
+
     def show_more(self):
         for _, console_filled in self._output:
             if console_filled:
                 return True
         return False
 
-    def execute(self, statement, code=None):
-        print(flush=True)
+    def execute(self, statement, code=None, quiet=False):
+        """
+        Return False if the interpreter had to be restarted, losing every
+        variable, because the statement didn't stop when interrupted.
+
+        When `quiet`, the output of the statement is discarded, and it
+        doesn't read from the terminal. Otherwise, it's paged (see
+        `show_more_output`).
+        """
+        if not quiet:
+            print(flush=True)
+        completed = True
+        if self._worker is not None:
+            completed = self._worker.execute(statement, code, quiet)
+            if not completed:
+                print(self._colored('*red*', 'The statement was stopped by '
+                                    'restarting the interpreter.'),
+                      file=sys.stderr, flush=True)
+        elif quiet:
+            with discard_output():
+                self._run(statement, code)
+        else:
+            with self._pager.capture():
+                self._run(statement, code)
+        if not quiet and not self.has_more_output():
+            print(end=self._hl_ps1, flush=True)
+        return completed
+
+    def _run(self, statement, code):
         if code is not None:
             self._interpreter.runcode(code)
         else:
             self._interpreter.compilesource(statement)
-        print(end=self._hl_ps1, flush=True)
+
+    def has_more_output(self):
+        if self._worker is not None:
+            return self._worker.pending_output > 0
+        return self._pager.pending > 0
+
+    def show_more_output(self):
+        """
+        Show the next page of the output of the last statement executed,
+        returning whether there's still more.
+        """
+        if self._worker is not None:
+            more = self._worker.show_more_output()
+        else:
+            more = self._pager.show_more()
+        if not more:
+            print(end=self._hl_ps1, flush=True)
+        return more
+
+    def drop_more_output(self):
+        if self.has_more_output():
+            if self._worker is not None:
+                self._worker.drop_more_output()
+            else:
+                self._pager.drop()
+            print(end='\n' + self._hl_ps1, flush=True)
 
     def interact(self):
         self._cleanup_pagination()
@@ -207,39 +423,21 @@ class PresenterShell(object):
                 except queue.Empty:
                     pass
         else:
-            ps1 = self._colored('*green*', self._ps1)
-            ps2 = self._colored('*green*', self._ps2)
-            lines = []
-            need_more = False
-            print(end='\r', flush=True)
-            while self._interacting:
-                try:
-                    try:
-                        line = input(ps2 if need_more else ps1)
-                        if PY2:
-                            line = line.decode(sys.stdin.encoding)
-                        lines.append(line)
-                    except EOFError:
-                        break
-                    else:
-                        source = '\n'.join(lines)
-                        if PY2:
-                            source = source.encode(sys.stdin.encoding)
-                        need_more = self._interpreter.runsource(source)
-                        if not need_more:
-                            yield lines
-                            lines = []
-                except KeyboardInterrupt:
-                    print(self._colored('*red*', '\nKeyboardInterrupt'),
-                          flush=True)
-                    lines = []
-                    need_more = False
-            print(flush=True)
+            prompts = (self._colored('*green*', self._ps1),
+                       self._colored('*green*', self._ps2),
+                       self._colored('*red*', 'KeyboardInterrupt'))
+            if self._worker is not None:
+                statements = self._worker.interact(*prompts)
+            else:
+                enable_completion(self._interpreter.locals)
+                statements = interact_with(self._interpreter, self, *prompts)
+            for lines in statements:
+                yield lines
         print(end=self._hl_ps1, flush=True)
         self._interacting = False
 
-    def ask_where_to_go(self, max_index):
-        new_index = ask_index(max_index, self._color_scheme)
+    def ask_where_to_go(self, count):
+        new_index = ask_index(count, self._color_scheme)
         print(end=self._hl_ps1, flush=True)
         return new_index
 
@@ -257,4 +455,7 @@ class PresenterShell(object):
         self.show('quit()', ['ps1'], typing_delay=30)
 
     def end(self):
+        self._pager.drop()
         print(flush=True)
+        if self._worker is not None:
+            self._worker.close()
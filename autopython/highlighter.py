@@ -1,24 +1,58 @@
 # -*- coding: utf-8 -*-
 
-HAVE_HIGHLIGHTING = True
-try:
-    import colorama
-    colorama.init()
-    del colorama
-except ImportError:
-    import os
-    if os.name == 'nt':
-        HAVE_HIGHLIGHTING = False
-        print("WARNING: 'colorama' is missing. Syntax highlighting won't work")
-    del os
-
-if HAVE_HIGHLIGHTING:
+from __future__ import print_function
+
+import os
+
+
+class _TokenType(tuple):
+    # Token types like those of pygments.token, which are tuples too, so they
+    # can be compared with them and used as the same dictionary keys without
+    # importing Pygments. Pygments, the lexers and colorama are imported when
+    # highlighting is first used, since it takes long.
+    def __getattr__(self, name):
+        if not name[:1].isupper():
+            raise AttributeError(name)
+        child = _TokenType(self + (name,))
+        setattr(self, name, child)
+        return child
+
+    def __repr__(self):
+        return 'Token' + ''.join('.' + name for name in self)
+
+
+Token = _TokenType()
+# The same aliases as in pygments.token
+Token.Token = Token
+Token.String = Token.Literal.String
+Token.Number = Token.Literal.Number
+HAVE_HIGHLIGHTING = False
+_highlighting_loaded = False
+
+
+def load_highlighting():
+    """Prepare the terminal for highlighting and tell if it's available."""
+    global HAVE_HIGHLIGHTING, _highlighting_loaded
+    if _highlighting_loaded:
+        return HAVE_HIGHLIGHTING
+    _highlighting_loaded = True
     try:
         import pygments
-        del pygments
+        HAVE_HIGHLIGHTING = True
     except ImportError:
-        HAVE_HIGHLIGHTING = False
+        pass
+    try:
+        import colorama
+        colorama.init()
+    except ImportError:
+        if os.name == 'nt':
+            HAVE_HIGHLIGHTING = False
+            print("WARNING: 'colorama' is missing. "
+                  "Syntax highlighting won't work")
+            return False
+    if not HAVE_HIGHLIGHTING:
         print("WARNING: 'pygments' is missing. Syntax highlighting won't work")
+    return HAVE_HIGHLIGHTING
 
 
 class LineLexer(object):
@@ -39,129 +73,172 @@ class LineLexer(object):
             yield prev_pos, Token.Text, text[prev_pos:]
 
 
-if HAVE_HIGHLIGHTING:
-    from pygments import highlight
-    from pygments.console import ansiformat
-    from pygments.formatters import TerminalFormatter
-    from pygments.lexers import Python3Lexer
-    from pygments.lexers import Python3TracebackLexer as TracebackLexer
-    from pygments.token import Token
-
-    COLOR_SCHEMES = {
-        'default': {
-            Token:                        '',
-            Token.Index:                  '**',
-            Token.Text:                   '',
-            Token.Whitespace:             'lightgray',
-            Token.Error:                  '_red_',
-            Token.Other:                  '',
-            Token.Comment:                'darkgray',
-            Token.Comment.Multiline:      '',
-            Token.Comment.Preproc:        'teal',
-            Token.Comment.Single:         '',
-            Token.Comment.Special:        '',
-            Token.Keyword:                'turquoise',
-            Token.Keyword.Constant:       '',
-            Token.Keyword.Declaration:    '',
-            Token.Keyword.Namespace:      '',
-            Token.Keyword.Pseudo:         '',
-            Token.Keyword.Reserved:       '',
-            Token.Keyword.Type:           'teal',
-            Token.Operator:               'fuchsia',
-            Token.Operator.Word:          'purple',
-            Token.Punctuation:            '',
-            Token.Name:                   '**',
-            Token.Name.Attribute:         '',
-            Token.Name.Builtin:           'teal',
-            Token.Name.Builtin.Pseudo:    '',
-            Token.Name.Class:             '*darkgreen*',
-            Token.Name.Constant:          '',
-            Token.Name.Decorator:         '',
-            Token.Name.Entity:            '',
-            Token.Name.Exception:         'teal',
-            Token.Name.Function:          'darkgreen',
-            Token.Name.Property:          '',
-            Token.Name.Label:             '',
-            Token.Name.Namespace:         '*yellow*',
-            Token.Name.Other:             '',
-            Token.Name.Tag:               'blue',
-            Token.Name.Variable:          '',
-            Token.Name.Variable.Class:    '',
-            Token.Name.Variable.Global:   '',
-            Token.Name.Variable.Instance: '',
-            Token.Number:                 'blue',
-            Token.Number.Float:           '',
-            Token.Number.Hex:             '',
-            Token.Number.Integer:         '',
-            Token.Number.Integer.Long:    '',
-            Token.Number.Oct:             '',
-            Token.Literal:                '',
-            Token.Literal.Date:           '',
-            Token.String:                 'yellow',
-            Token.String.Backtick:        '',
-            Token.String.Char:            '',
-            Token.String.Doc:             '',
-            Token.String.Double:          '',
-            Token.String.Escape:          '',
-            Token.String.Heredoc:         '',
-            Token.String.Interpol:        '',
-            Token.String.Other:           '',
-            Token.String.Regex:           '',
-            Token.String.Single:          '',
-            Token.String.Symbol:          '',
-            Token.Generic:                '',
-            Token.Generic.Deleted:        'red',
-            Token.Generic.Emph:           '',
-            Token.Generic.Error:          'red',
-            Token.Generic.Heading:        '**',
-            Token.Generic.Inserted:       'darkgreen',
-            Token.Generic.Output:         '',
-            Token.Generic.Prompt:         'lightgray',
-            Token.Generic.Strong:         '**',
-            Token.Generic.Subheading:     '*purple*',
-            Token.Generic.Traceback:      '',
-        }
-    }
+class ColorTable(dict):
+    # Maps every token type to the escape sequences turning its color on and
+    # off, resolving the colors inherited from parent types only once.
+    def __init__(self, color_scheme='default'):
+        dict.__init__(self)
+        self._color_scheme = color_scheme
+        for ttype in COLOR_SCHEMES.get(color_scheme, ()):
+            self[ttype]
 
-    def get_color_for(ttype, color_scheme='default'):
-        scheme = COLOR_SCHEMES.get(color_scheme)
-        if scheme is None:
-            return ''
-        while ttype:
-            color = scheme.get(ttype)
-            if color:
-                return color
-            ttype = ttype[:-1]
-        return ''
+    def __missing__(self, ttype):
+        escapes = self[ttype] = get_escapes(
+            get_color_for(ttype, self._color_scheme))
+        return escapes
 
-else:
-    class Token:
-        pass
 
-    Token.Index = Token()
-    Token.Prompt = Token()
-    Token.Text = Token()
-    Token.Literal = Token()
-    Token.Literal.String = Token()
-    Token.Literal.String.Doc = Token()
-    Token.Generic = Token
+COLOR_TABLES = {}
+
 
-    COLOR_SCHEMES = {'default': {}}
+def get_color_table(color_scheme='default'):
+    table = COLOR_TABLES.get(color_scheme)
+    if table is None:
+        table = COLOR_TABLES[color_scheme] = ColorTable(color_scheme)
+    return table
 
-    Python3Lexer = LineLexer
-    TracebackLexer = LineLexer
 
-    class TerminalFormatter(object):
-        def __init__(self, *args, **kwargs):
-            pass
+def colorize(color, text):
+    color_on, color_off = get_escapes(color)
+    return color_on + text + color_off
 
-    def highlight(code, lexer, formatter, outfile=None):
-        if outfile is None:
-            return code
-        outfile.write(code)
 
-    def ansiformat(attr, text):
-        return text
+def format_tokens(tokens, color_table):
+    # Like pygments' TerminalFormatter, but using a color table.
+    result = []
+    for ttype, text in tokens:
+        color_on, color_off = color_table[ttype]
+        for line in text.splitlines(True):
+            text = line.rstrip('\n')
+            if text and color_on:
+                text = color_on + text + color_off
+            result.append(text)
+            if line.endswith('\n'):
+                result.append('\n')
+    return ''.join(result)
 
-    def get_color_for(ttype, color_scheme='default'):
-        return None
+
+def get_lexer(color_scheme=None):
+    if color_scheme and load_highlighting():
+        from pygments.lexers import Python3Lexer
+        return Python3Lexer()
+    return LineLexer()
+
+
+def get_traceback_lexer():
+    if load_highlighting():
+        from pygments.lexers import Python3TracebackLexer
+        return Python3TracebackLexer()
+    return LineLexer()
+
+
+def get_color_for(ttype, color_scheme='default'):
+    scheme = COLOR_SCHEMES.get(color_scheme)
+    if not scheme:
+        return ''
+    while ttype:
+        color = scheme.get(ttype)
+        if color:
+            return color
+        ttype = ttype[:-1]
+    return ''
+
+
+# Pygments 2.2 renamed the colors
+NEW_COLOR_NAMES = {
+    'darkgray': 'brightblack', 'lightgray': 'gray',
+    'darkred': 'red', 'red': 'brightred',
+    'darkgreen': 'green', 'green': 'brightgreen',
+    'brown': 'yellow', 'yellow': 'brightyellow',
+    'darkblue': 'blue', 'blue': 'brightblue',
+    'purple': 'magenta', 'fuchsia': 'brightmagenta',
+    'teal': 'cyan', 'turquoise': 'brightcyan',
+}
+
+
+def get_escapes(color):
+    if not color or not load_highlighting():
+        return '', ''
+    from pygments.console import ansiformat, codes
+    name = color.strip('*_+')
+    if name in NEW_COLOR_NAMES and 'brightblack' in codes:
+        color = color.replace(name, NEW_COLOR_NAMES[name])
+    color_on, color_off = ansiformat(color, '|').split('|')
+    return color_on, color_off
+
+
+COLOR_SCHEMES = {
+    'default': {
+        Token:                        '',
+        Token.Index:                  '**',
+        Token.Text:                   '',
+        Token.Whitespace:             'lightgray',
+        Token.Error:                  '_red_',
+        Token.Other:                  '',
+        Token.Comment:                'darkgray',
+        Token.Comment.Multiline:      '',
+        Token.Comment.Preproc:        'teal',
+        Token.Comment.Single:         '',
+        Token.Comment.Special:        '',
+        Token.Keyword:                'turquoise',
+        Token.Keyword.Constant:       '',
+        Token.Keyword.Declaration:    '',
+        Token.Keyword.Namespace:      '',
+        Token.Keyword.Pseudo:         '',
+        Token.Keyword.Reserved:       '',
+        Token.Keyword.Type:           'teal',
+        Token.Operator:               'fuchsia',
+        Token.Operator.Word:          'purple',
+        Token.Punctuation:            '',
+        Token.Name:                   '**',
+        Token.Name.Attribute:         '',
+        Token.Name.Builtin:           'teal',
+        Token.Name.Builtin.Pseudo:    '',
+        Token.Name.Class:             '*darkgreen*',
+        Token.Name.Constant:          '',
+        Token.Name.Decorator:         '',
+        Token.Name.Entity:            '',
+        Token.Name.Exception:         'teal',
+        Token.Name.Function:          'darkgreen',
+        Token.Name.Property:          '',
+        Token.Name.Label:             '',
+        Token.Name.Namespace:         '*yellow*',
+        Token.Name.Other:             '',
+        Token.Name.Tag:               'blue',
+        Token.Name.Variable:          '',
+        Token.Name.Variable.Class:    '',
+        Token.Name.Variable.Global:   '',
+        Token.Name.Variable.Instance: '',
+        Token.Number:                 'blue',
+        Token.Number.Float:           '',
+        Token.Number.Hex:             '',
+        Token.Number.Integer:         '',
+        Token.Number.Integer.Long:    '',
+        Token.Number.Oct:             '',
+        Token.Literal:                '',
+        Token.Literal.Date:           '',
+        Token.String:                 'yellow',
+        Token.String.Backtick:        '',
+        Token.String.Char:            '',
+        Token.String.Doc:             '',
+        Token.String.Double:          '',
+        Token.String.Escape:          '',
+        Token.String.Heredoc:         '',
+        Token.String.Interpol:        '',
+        Token.String.Other:           '',
+        Token.String.Regex:           '',
+        Token.String.Single:          '',
+        Token.String.Symbol:          '',
+        Token.Generic:                '',
+        Token.Generic.Deleted:        'red',
+        Token.Generic.Emph:           '',
+        Token.Generic.Error:          'red',
+        Token.Generic.Heading:        '**',
+        Token.Generic.Inserted:       'darkgreen',
+        Token.Generic.Output:         '',
+        Token.Generic.Prompt:         'lightgray',
+        Token.Generic.Strong:         '**',
+        Token.Generic.Subheading:     '*purple*',
+        Token.Generic.Traceback:      '',
+    }
+}
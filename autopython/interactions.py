@@ -7,7 +7,7 @@ import signal
 import time
 
 from . import console, highlighter as hl
-from .compat import input, print
+from .compat import input, monotonic, print
 from .highlighter import Token
 
 
@@ -24,19 +24,21 @@ def _tokenize(lexer, statement):
             yield ttype, text
 
 
-def layout_code(lexer, statement, prompts, index_number=None, index_line=-1,
+def layout_code(tokens, statement, prompts, index_number=None, index_line=-1,
                 scroll_context_lines=1, console_width=-1, console_height=-1):
+    # `tokens` are the (type, text) pairs from `_tokenize` for the statement.
     # This generator yields a tuple containing:
     #  - line and column number
     #  - The type of the text
     #  - The text
     #  - A flag telling if the text should be typed.
     #  - A flag indicating that the console screen is completely filled.
-    size = console.get_terminal_size()
-    if console_width < 1:
-        console_width = size.columns - 1
-    if console_height < 1:
-        console_height = size.lines
+    # Unless given, the console size is checked on every line, so the code
+    # still to be shown fits the console if it's resized meanwhile.
+    def console_size():
+        size = console.get_terminal_size()
+        return (console_width if console_width >= 1 else size.columns - 1,
+                console_height if console_height >= 1 else size.lines)
 
     if index_number is None or index_line < 0:
         index_str = ''
@@ -45,16 +47,17 @@ def layout_code(lexer, statement, prompts, index_number=None, index_line=-1,
 
     max_line = statement.count('\n')
     displayed_line = 0
-    display_limit = console_height
+    line_width, display_limit = console_size()
     line = 0
     col = 0
     iter_prompts = iter(prompts)
-    for ttype, text in _tokenize(lexer, statement):
+    for ttype, text in tokens:
         if col == 0:
             prompt, prompt_len = next(iter_prompts)
             yield line, 0, None, '\r' + prompt, False, False
             col = prompt_len
-            width = console_width - col
+            line_width = console_size()[0]
+            width = line_width - col
             if line == index_line:
                 width -= len(index_str)
                 yield line, col, None, ' ' * width, False, False
@@ -71,7 +74,7 @@ def layout_code(lexer, statement, prompts, index_number=None, index_line=-1,
             is_full = displayed_line == display_limit
             if is_full:
                 displayed_line = 0
-                display_limit = console_height - scroll_context_lines
+                display_limit = console_size()[1] - scroll_context_lines
             yield line, col, None, '\n', False, is_full
         else:
             new_col = col + len(text)
@@ -82,59 +85,187 @@ def layout_code(lexer, statement, prompts, index_number=None, index_line=-1,
                 is_full = displayed_line == display_limit
                 if is_full:
                     displayed_line = 0
-                    display_limit = console_height - scroll_context_lines
+                    display_limit = console_size()[1] - scroll_context_lines
                 yield line, new_col - extra, None, '\n', False, is_full
                 text = text[-extra:]
                 col = 0
                 new_col = len(text)
-                width = console_width
+                width = line_width
 
             yield line, col, ttype, text, True, False
             col = new_col
 
 
-def simulate_typing(tokens, color_scheme=None, typing_delay=30):
-    colorize = hl.HAVE_HIGHLIGHTING and color_scheme is not None
-    delay = typing_delay / 1000.0
+# When accelerating, every line is typed this much faster than the previous
+# one, up to the minimum delay factor.
+ACCELERATION = 0.85
+MIN_DELAY_FACTOR = 0.25
+
+
+class TypingSchedule(object):
+    # When every typed character (but whitespace) must be shown, relative to
+    # when typing started, so the time spent writing and sleeping too much
+    # doesn't slow typing down: when late, characters are typed right away.
+    # If typing would take longer than `max_typing_time` seconds, it's done
+    # faster.
+    def __init__(self, line_chars, typing_delay, max_typing_time=None,
+                 accelerate=False):
+        self.delay = typing_delay / 1000.0
+        self._deadlines = []
+        deadline = 0.0
+        for line, char_count in enumerate(line_chars):
+            delay = self.delay
+            if accelerate:
+                delay *= max(ACCELERATION ** line, MIN_DELAY_FACTOR)
+            for _ in range(char_count):
+                deadline += delay * (0.5 + random.random())
+                self._deadlines.append(deadline)
+        if max_typing_time and deadline > max_typing_time:
+            scale = max_typing_time / deadline
+            self._deadlines = [d * scale for d in self._deadlines]
+        self._typed = 0
+        self._start = None
+        self._paused_at = None
+        self._finished_at = None
+
+    def resume(self):
+        now = monotonic()
+        if self._start is None:
+            self._start = now
+        elif self._paused_at is not None:
+            self._start += now - self._paused_at
+        self._paused_at = None
+
+    def pause(self):
+        if self._paused_at is None:
+            self._paused_at = monotonic()
+
+    def wait(self):
+        if self._typed < len(self._deadlines):
+            deadline = self._start + self._deadlines[self._typed]
+        else:
+            deadline = monotonic() + self.delay
+        self._typed += 1
+        remaining = deadline - monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        self._finished_at = monotonic()
+
+    def speed(self):
+        # Characters per second achieved and requested.
+        if self._finished_at is None or self._finished_at <= self._start:
+            return None
+        if self._deadlines:
+            requested = len(self._deadlines) / self._deadlines[-1]
+        else:
+            requested = 1 / self.delay
+        return self._typed / (self._finished_at - self._start), requested
+
+
+def count_typed_chars(tokens, statement):
+    # How many characters (but whitespace) of the tokens of the statement
+    # `layout_code` types on every line.
+    max_line = statement.count('\n')
+    counts = [0]
+    for _, text in tokens:
+        if text == '\n':
+            if len(counts) == max_line:
+                break
+            counts.append(0)
+        else:
+            counts[-1] += sum(1 for char in text if not char.isspace())
+    return counts
+
+
+class TypingStopped(Exception):
+    pass
+
+
+def _typing_interrupted(skip_keys, stop_keys):
+    # Return the first skip or stop key pressed, ignoring any other.
+    while console.kbhit():
+        key = console.getch()
+        if key in stop_keys:
+            console.ungetch(key)
+            return key
+        if key in skip_keys:
+            return key
+    return None
+
+
+def simulate_typing(tokens, color_scheme=None, schedule=None, skip_keys=(),
+                    stop_keys=()):
+    # The code is typed following the TypingSchedule (built from the
+    # `count_typed_chars` of the statement), or shown at once without one.
+    # The output is written once per typed character or, without delay, once
+    # per screen. Pressing one of the `skip_keys` while typing shows the rest
+    # of the code right away, and one of the `stop_keys` raises TypingStopped,
+    # leaving the key to be read by `console.getch`.
+    colorize = color_scheme is not None and hl.load_highlighting()
+    if colorize:
+        color_table = hl.get_color_table(color_scheme)
     current_line = 0
+    output = console.BufferedWriter()
     prev_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
     try:
         console.disable_echo()
         for line, _, ttype, text, type_it, console_filled in tokens:
             if line != current_line or console_filled:
+                if console_filled:
+                    output.flush()
+                    if schedule is not None:
+                        schedule.pause()
                 yield current_line, console_filled
                 current_line = line
 
             if colorize and ttype:
-                color = hl.get_color_for(ttype, color_scheme)
-                color_on, color_off = hl.ansiformat(color, '|').split('|')
-                print(end=color_on)
-
-            if delay and type_it:
-                for char in text:
-                    print(end=char, flush=True)
-                    if not char.isspace():
-                        time.sleep(delay * (0.5 + random.random()))
+                color_on, color_off = color_table[ttype]
+                output.write(color_on)
+
+            if schedule is not None and type_it:
+                schedule.resume()
+                for position, char in enumerate(text):
+                    output.write(char)
+                    if char.isspace():
+                        continue
+                    output.flush()
+                    key = None
+                    if skip_keys or stop_keys:
+                        key = _typing_interrupted(skip_keys, stop_keys)
+                    if key in stop_keys:
+                        if colorize and ttype:
+                            output.write(color_off)
+                        raise TypingStopped()
+                    elif key is not None:
+                        output.write(text[position + 1:])
+                        schedule = None
+                        break
+                    schedule.wait()
             else:
-                print(end=text, flush=True)
+                output.write(text)
 
             if colorize and ttype:
-                print(end=color_off)
+                output.write(color_off)
 
+        output.flush()
         yield current_line, False
     finally:
+        output.flush()
         signal.signal(signal.SIGINT, prev_sigint_handler)
         console.enable_echo()
 
 
-def ask_index(max_index, color_scheme=None):
+def ask_index(count, color_scheme=None):
+    # `count(n)` returns how many statements there are, waiting only until
+    # there are at least n of them (or all of them, if n is None).
     def colored(color, text):
-        return hl.ansiformat(color, text) if color_scheme else text
+        return hl.colorize(color, text) if color_scheme else text
     try:
         print(end=colored('*green*', '\n\nEnter new index: '))
         text = input().strip()
         if text:
             new_index = int(text)
+            max_index = count(new_index if new_index > 0 else None)
             if new_index == 0 or abs(new_index) > max_index:
                 raise ValueError
             if new_index < 0:
@@ -149,7 +280,7 @@ def ask_index(max_index, color_scheme=None):
         new_index = None
         print(colored('*red*', 'Invalid index:'), repr(text),
               '(only indexes from 1 to {0} (or from -{0} to -1) '
-              'are allowed).'.format(max_index))
+              'are allowed).'.format(count()))
     except KeyboardInterrupt:
         new_index = None
         print(colored('*red*', '\nKeyboardInterrupt'))
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import re
+import sys
+import tempfile
+
+from contextlib import contextmanager
+from . import console
+from .highlighter import colorize
+
+# Characters of output shown at once by default.
+MAX_CHARS = 64 * 1024
+# The rest of the output is kept in memory up to this size, then in a file.
+MAX_MEMORY_SIZE = 1024 * 1024
+_CHUNK_SIZE = 8192
+_ESCAPE_SEQUENCE = re.compile('\x1b\\[[0-9;]*m')
+
+
+class OutputPager(object):
+    """
+    Writes the output of a statement, but only up to `max_lines` lines (as
+    they're shown in the terminal, as many as fit in it by default) or
+    `max_chars` characters, keeping the rest to be shown later a page at a
+    time. Neither is limited if 0.
+
+    So a huge output doesn't keep the terminal busy scrolling it, and its
+    beginning can be read.
+    """
+    def __init__(self, max_lines=None, max_chars=None, color_scheme=None):
+        self._max_lines = max_lines
+        self._max_chars = MAX_CHARS if max_chars is None else max_chars
+        self._color_scheme = color_scheme
+        self._rest = None
+        # Where the rest of the output would end in the terminal, and where
+        # the part of it already shown ends.
+        self._rest_end = self._shown_end = (0, 0)
+        self._decoder = None
+        self._leftover = ''
+        self._rows = None
+        self._chars = None
+        self._column = 0
+        self._marker_length = 0
+
+    @property
+    def overflowing(self):
+        """Whether the output is being kept instead of written."""
+        return self._rest is not None
+
+    @property
+    def pending(self):
+        """How many lines of the output are still to be shown."""
+        if self._rest is None:
+            return 0
+        rows, column = self._rest_end
+        return max(rows + (column > 0) - self._shown_end[0], 1)
+
+    @contextmanager
+    def capture(self):
+        """Page what's written meanwhile to the standard output and error."""
+        self.drop()
+        self._start_page()
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = paged_stdout = _PagedStream(self, stdout)
+        sys.stderr = paged_stderr = _PagedStream(self, stderr)
+        try:
+            yield
+        finally:
+            # Unless the statement replaced them.
+            if sys.stdout is paged_stdout:
+                sys.stdout = stdout
+            if sys.stderr is paged_stderr:
+                sys.stderr = stderr
+            if self._rest is not None:
+                self._rest.seek(0)
+                self._decoder = codecs.getincrementaldecoder('utf-8')(
+                    'replace')
+                self._show_marker()
+
+    def write(self, stream, text):
+        if self._rest is None:
+            shown = self._fit(text)
+            stream.write(text[:shown])
+            if shown == len(text):
+                return
+            stream.flush()
+            text = text[shown:]
+            self._rest = tempfile.SpooledTemporaryFile(MAX_MEMORY_SIZE)
+            self._rest_end = self._shown_end = (0, 0)
+        self._rest_end = _measure(text, self._rest_end)
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        self._rest.write(text)
+
+    def show_more(self):
+        """
+        Show the next page of the rest of the output, returning whether there's
+        still more.
+        """
+        if self._rest is None:
+            return False
+        stream = sys.stdout
+        stream.write('\r' + ' ' * self._marker_length + '\r')
+        self._start_page()
+        while True:
+            text = self._leftover
+            if not text:
+                data = self._rest.read(_CHUNK_SIZE)
+                text = self._decoder.decode(data, not data)
+                if not data and not text:
+                    break
+            shown = self._fit(text)
+            stream.write(text[:shown])
+            self._shown_end = _measure(text[:shown], self._shown_end)
+            self._leftover = text[shown:]
+            if self._leftover:
+                self._show_marker()
+                return True
+        stream.flush()
+        self.drop()
+        return False
+
+    def drop(self):
+        """Forget the rest of the output."""
+        if self._rest is not None:
+            self._rest.close()
+            self._rest = None
+        self._leftover = ''
+
+    def _start_page(self):
+        lines = self._max_lines
+        if lines is None:
+            # The marker and the prompt are shown after the page.
+            lines = max(console.get_terminal_size().lines - 2, 1)
+        self._rows = lines or None
+        self._chars = self._max_chars or None
+        self._column = 0
+
+    def _fit(self, text):
+        # Return how much of the text fits in the page, following where it
+        # would be written in the terminal.
+        end = len(text)
+        if self._chars is not None:
+            end = min(end, self._chars)
+        if self._rows == 0:
+            return 0
+        if self._rows is not None:
+            width = max(console.get_terminal_size().columns, 1)
+            position = 0
+            while position < end:
+                newline = text.find('\n', position, end)
+                line_end = end if newline == -1 else newline
+                room = max(width - self._column + (self._rows - 1) * width, 0)
+                length = _length(text, position, line_end)
+                if length > room:
+                    end = position + room
+                    self._column = width
+                    break
+                column = self._column + length
+                wrapped = max(column - 1, 0) // width
+                self._rows -= wrapped
+                self._column = column - wrapped * width
+                if newline == -1:
+                    break
+                self._rows -= 1
+                self._column = 0
+                position = newline + 1
+                if self._rows == 0:
+                    end = position
+                    break
+        if end < len(text):
+            # Not to cut an escape sequence in half.
+            escape = text.rfind('\x1b', 0, end)
+            if escape != -1 and text.find('m', escape, end) == -1:
+                end = escape
+        if self._chars is not None:
+            self._chars -= end
+        return end
+
+    def _show_marker(self):
+        lines = self.pending
+        marker = '... {} more line{}'.format(lines, '' if lines == 1 else 's')
+        self._marker_length = len(marker)
+        if self._color_scheme:
+            marker = colorize('*yellow*', marker)
+        sys.stdout.write(('\n' if self._column else '') + marker)
+        sys.stdout.flush()
+
+
+def _length(text, start, end):
+    # How many columns of the terminal the text between `start` and `end`
+    # (without newlines) takes.
+    if text.find('\x1b', start, end) == -1:
+        return end - start
+    return len(_ESCAPE_SEQUENCE.sub('', text[start:end]))
+
+
+def _measure(text, start):
+    # Return the row (counting from 0) and column where the text ends in the
+    # terminal, written from the given ones. Rows filled up are counted.
+    rows, column = start
+    width = max(console.get_terminal_size().columns, 1)
+    position = 0
+    while True:
+        newline = text.find('\n', position)
+        line_end = len(text) if newline == -1 else newline
+        column += _length(text, position, line_end)
+        rows += column // width
+        column %= width
+        if newline == -1:
+            return rows, column
+        rows += 1
+        column = 0
+        position = newline + 1
+
+
+class _PagedStream(object):
+    # Stands for the standard output or error meanwhile the pager captures
+    # them.
+    def __init__(self, pager, stream):
+        self._pager = pager
+        self._stream = stream
+
+    @property
+    def overflowing(self):
+        return self._pager.overflowing
+
+    def write(self, text):
+        self._pager.write(self._stream, text)
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+__all__ = ['OutputPager']
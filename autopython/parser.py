@@ -1,88 +1,754 @@
 # -*- coding: utf-8 -*-
 
+import __future__
+import array
+import ast
+import bisect
 import codecs
 import codeop
 import io
+import marshal
+import mmap
 import os
 import re
 import sys
+import threading
+import tokenize
 
-from collections import namedtuple
+from collections import OrderedDict
+from contextlib import contextmanager
 from .compat import PY2
 
 ENCODING_RE = re.compile(('' if PY2 else '(?a)') +
                          r'^[ \t\f]*#.*coding[:=][ \t]*([-\w.]+)')
 
-StatementInfo = namedtuple('StatementInfo',
-                           'line_number statement prompts first_line code')
-
-
-def parse_file(filename):
-    compiler = codeop.CommandCompiler()
-
+WHITESPACE_BYTES = b' \t\n\r\x0b\x0c'
+NEWLINE_BYTES_RE = re.compile(b'\r\n?|\n')
+LINE_RE = re.compile(u'[^\n]*\n')
+DECODING_CHUNK_SIZE = 64 * 1024
+
+COMPOUND_KEYWORDS = frozenset(['@', 'async', 'class', 'def', 'for', 'if',
+                               'try', 'while', 'with'])
+BLOCK_CONTINUATION_RE = re.compile(r'(elif|else|except|finally)\b')
+BLOCK_LINE_STARTS = (' ', '\t', '\f', '\r', '\n', '#')
+NON_CODE_TOKENS = (tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT,
+                   tokenize.ENDMARKER)
+
+COMPILE_CHUNK_SIZE = 256
+# Errors found only compiling a statement come with one of these words (or
+# with a keyword argument repeated), like `return` outside a function.
+COMPILER_CHECKED_WORDS = ('return', 'yield', 'await', 'async', 'break',
+                          'continue', 'nonlocal', 'global', 'import',
+                          'except', 'with', 'del', 'exec', 'match', 'case',
+                          'type', 'lambda', 'class', 'def', '__debug__', ':=')
+STARRED_RE = re.compile(r'(?:^|[^\w\s)\]}\'"]|\b(?:and|assert|elif|else|'
+                        r'for|if|in|is|not|or|print|while))\s*\*', re.M)
+DEEP_INDENT_RE = re.compile(r'^[ \t]{19}', re.M)
+KEYWORD_ARGUMENT_RE = re.compile(r'[(,]\s*(\w+)\s*=(?!=)')
+SIMPLE_STATEMENT_TYPES = tuple(
+    getattr(ast, name) for name in ('Assign', 'AugAssign', 'AnnAssign',
+                                    'Expr', 'Pass') if hasattr(ast, name))
+FUTURE_FLAGS = 0
+for _feature_name in __future__.all_feature_names:
+    FUTURE_FLAGS |= getattr(__future__, _feature_name).compiler_flag
+del _feature_name
+
+
+def parse_file(filename, stream=False, jobs=1, callback=None,
+               code_cache_size=None):
+    # The source is read (and checked) right away, but when streaming, the
+    # statements are split in the background while the table is being used.
+    # Once every statement is parsed, `callback` is called with the table.
+    # With a `code_cache_size`, statements are only checked for syntax
+    # errors and compiled when needed, keeping that many code objects.
+    return parse_source_lines(read_source_code(filename), stream, jobs,
+                              callback, code_cache_size)
+
+
+def parse_source_lines(source_lines, stream=False, jobs=1, callback=None,
+                       code_cache_size=None):
+    source_lines, line_number = strip_encoding_declaration(source_lines)
+    if code_cache_size is not None:
+        records = iter_checked_statements(source_lines, line_number)
+    elif jobs > 1:
+        records = iter_compiled_statements(source_lines, line_number, jobs)
+    else:
+        records = iter_statements(source_lines, line_number)
+    table = StatementTable(source_lines, code_cache_size)
+    table.base_line_number = line_number
+    if stream:
+        table.fill_in_background(records, callback)
+    else:
+        table.fill(records, callback)
+    return table
+
+
+def reparse_file(filename, table):
+    """
+    Update the table of statements of the given script with its current
+    contents, splitting again only the statements around the changed lines.
+
+    Return None if nothing changed, or a tuple with the index of the first
+    statement changed, the index where the old statements stopped changing
+    and the index where the new statements end.
+    """
     source_lines = read_source_code(filename)
     source_lines, line_number = strip_encoding_declaration(source_lines)
-
-    statements = []
-    statement = ''
-    prompts = []
-    statement_started = False
-    statement_first_line = statement_current_line = -1
+    statement_count = table.wait_for()
+    old_lines = table.source_lines()
+    old_count, new_count = len(old_lines), len(source_lines)
+    limit = min(old_count, new_count)
+    moved = line_number != table.base_line_number
+    if moved:
+        # Every line number changes, so nothing can be kept.
+        table.base_line_number = line_number
+        limit = 0
+
+    # Find the lines that didn't change at both ends.
+    prefix = 0
+    while prefix < limit and old_lines[prefix] == source_lines[prefix]:
+        prefix += 1
+    if prefix == old_count == new_count and not moved:
+        return None
+    suffix = 0
+    while suffix < limit - prefix and \
+            old_lines[-1 - suffix] == source_lines[-1 - suffix]:
+        suffix += 1
+
+    # Where a statement ends depends on its lines and on the lines after it
+    # (a line following it can continue its block, and comments at the end
+    # are grouped with the next statement if there's one). To be safe, the
+    # statement before the one with the last line unchanged is split again.
+    first = max(bisect.bisect_right(table.rows, max(prefix - 1, 0)) - 2, 0)
+    if first < statement_count:
+        start, future_flags = table.rows[first], table.future_flags[first]
+    else:
+        start, future_flags = 0, 0
+    if table.code_cache_size is not None:
+        new_records = iter_checked_statements(source_lines, line_number,
+                                              start, future_flags)
+    else:
+        compiler = codeop.CommandCompiler()
+        compiler.compiler.flags |= future_flags
+        new_records = iter_statements(source_lines, line_number, compiler,
+                                      start)
+
+    # Stop once a statement starts where an old one did within the lines
+    # after the change (if compiled the same way, the rest are the same),
+    # but not at the first statement found there, splitting one more.
+    row_delta = new_count - old_count
+    records = []
+    last = statement_count
+    unchanged_starts = 0
+    for record in new_records:
+        if record[0] >= new_count - suffix:
+            unchanged_starts += 1
+        if unchanged_starts > 1:
+            old_row = record[0] - row_delta
+            index = bisect.bisect_left(table.rows, old_row, first)
+            if index < statement_count and table.rows[index] == old_row \
+                    and table.future_flags[index] == record[5]:
+                last = index
+                break
+        records.append(record)
+
+    def statement(index):
+        return table.statement_lines(index), table.future_flags[index]
+
+    old_statements = [statement(index) for index in range(first, last)]
+    table.replace(source_lines, first, last, records, row_delta)
+    new_statements = [statement(index)
+                      for index in range(first, first + len(records))]
+    if moved:
+        return first, last, first + len(records)
+
+    # Leave out the statements split again that stayed the same.
+    while old_statements and new_statements and \
+            old_statements[-1] == new_statements[-1]:
+        old_statements.pop()
+        new_statements.pop()
+    same = 0
+    while same < min(len(old_statements), len(new_statements)) and \
+            old_statements[same] == new_statements[same]:
+        same += 1
+    return (first + same, first + len(old_statements),
+            first + len(new_statements))
+
+
+def split_statements(source_lines, line_number=0):
+    table = StatementTable(source_lines)
+    table.fill(iter_statements(source_lines, line_number))
+    return list(table)
+
+
+def iter_statements(source_lines, line_number=0, compiler=None, start=0):
+    # Statements end where the interactive shell would stop asking for more
+    # lines. Instead of compiling the pending statement after every line (as
+    # the shell does), the source is tokenized once to find the few lines
+    # where a statement may end, and it's compiled only there.
+    #
+    # Every statement is yielded as a tuple with its first source line, how
+    # many lines it spans, the line where the code starts (after comments
+    # and empty lines), its line number in the file, its code object and the
+    # __future__ flags it was compiled with.
+    if compiler is None:
+        compiler = codeop.CommandCompiler()
+    scanner = None
+    line_count = len(source_lines)
     statement_line_number = line_number
 
-    for line in source_lines:
-        line_number += 1
-        statement_current_line += 1
-
-        prompts.append('ps2' if statement_started else 'ps1')
-        statement += line
+    while start < line_count:
+        # Comments and empty lines are typed along with the next statement.
+        first = start
+        while first < line_count and (source_lines[first].startswith('#') or
+                                      not source_lines[first].strip()):
+            first += 1
+
+        future_flags = compiler.compiler.flags & FUTURE_FLAGS
+        if first == line_count:
+            yield _last_statement(compiler, source_lines, start, -1,
+                                  statement_line_number) + (future_flags,)
+            break
 
-        is_empty_line = line.strip() == ''
-        statement_started = statement_started or not is_empty_line
+        statement_line_number = line_number + first + 1
+        if scanner is None or scanner.failed and first >= scanner.scanned:
+            scanner = _LineScanner(source_lines, first)
 
-        if statement_first_line == -1:
-            if line.startswith('#'):
+        for last in range(first, line_count):
+            if not _may_end_statement(source_lines, first, last, scanner):
                 continue
-            elif is_empty_line:
-                statement_started = False
+            statement = ''.join(source_lines[start:last + 1])
+            code, compiled = compile_statement(compiler, statement)
+            if not compiled:
                 continue
-            else:
-                statement_first_line = statement_current_line
-                statement_line_number = line_number
+            if code is None and last > first:
+                # A syntax error could have been spotted on an earlier line.
+                last, code = _find_statement_end(compiler, source_lines,
+                                                 start, first, last)
+                if last not in scanner.closed_lines:
+                    scanner = None
+            yield (start, last + 1 - start, first - start,
+                   statement_line_number, code, future_flags)
+            start = last + 1
+            break
+        else:
+            record = _last_statement(compiler, source_lines, start,
+                                     first - start, statement_line_number)
+            if record[4] is None and line_count - 1 > first:
+                # Unfinished, but the shell could have found a syntax error
+                # on an earlier line and gone on with the next ones.
+                last, code = _find_statement_end(compiler, source_lines,
+                                                 start, first, line_count - 1)
+                if last < line_count - 1:
+                    if last not in scanner.closed_lines:
+                        scanner = None
+                    yield (start, last + 1 - start, first - start,
+                           statement_line_number, code, future_flags)
+                    start = last + 1
+                    continue
+            yield record + (future_flags,)
+            break
 
-        code, compiled = compile_statement(compiler, statement)
-        if compiled:
-            statements.append(StatementInfo(statement_line_number, statement,
-                              prompts, statement_first_line, code))
+
+def iter_checked_statements(source_lines, line_number=0, start=0,
+                            future_flags=0):
+    # Statements are split only parsing them. Instead of a code object, they
+    # get None if they have syntax errors or False otherwise, so they can be
+    # compiled later.
+    compiler = codeop.CommandCompiler()
+    compiler.compiler = _SyntaxChecker()
+    compiler.compiler.flags |= future_flags
+    for record in iter_statements(source_lines, line_number, compiler,
+                                  start):
+        code = None if record[4] is None else False
+        yield record[:4] + (code,) + record[5:]
+
+
+def iter_compiled_statements(source_lines, line_number=0, jobs=None):
+    # Statements are split here, only parsing them, while a pool of `jobs`
+    # processes compiles them (code objects travel back marshaled). Splitting
+    # takes a processor, so with no other one they're compiled here.
+    import multiprocessing
+    jobs = min(jobs or multiprocessing.cpu_count(),
+               multiprocessing.cpu_count() - 1)
+    if jobs < 1:
+        for record in iter_statements(source_lines, line_number):
+            yield record
+        return
+    parsed = []
+
+    def tasks():
+        for record in iter_checked_statements(source_lines, line_number):
+            parsed.append(record)
+            yield join_lines(source_lines, *record[:2]), record[-1]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.imap(_compile_in_worker, tasks(), COMPILE_CHUNK_SIZE)
+        for index, code in enumerate(results):
+            yield parsed[index][:4] + (marshal.loads(code),) + \
+                parsed[index][5:]
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _compile_in_worker(task):
+    statement, future_flags = task
+    compiler = codeop.CommandCompiler()
+    compiler.compiler.flags |= future_flags
+    code, _ = compile_statement(compiler, statement)
+    return marshal.dumps(code)
+
+
+class _SyntaxChecker(object):
+    # Stands in for codeop.Compile, but without compiling code objects.
+    # Some errors (like `return` outside a function) are only found
+    # compiling the tree, and they can end a statement on a different line,
+    # so it's compiled (and thrown away) when the statement may have one.
+    # Like codeop.Compile, it keeps track of the __future__ statements seen
+    # so far in its flags.
+
+    def __init__(self):
+        self.flags = codeop.Compile().flags | ast.PyCF_ONLY_AST
+
+    def __call__(self, source, filename, symbol, **kwargs):
+        flags = self.flags
+        if kwargs.get('incomplete_input', True) is False:
+            flags &= ~(codeop.PyCF_DONT_IMPLY_DEDENT |
+                       getattr(codeop, 'PyCF_ALLOW_INCOMPLETE_INPUT', 0))
+        tree = compile(source, filename, symbol, flags, True)
+        if not _needs_compiling(source, tree):
+            return tree
+        # Compiling the tree saves parsing the source again
+        code = compile(tree, filename, symbol, flags & ~ast.PyCF_ONLY_AST,
+                       True)
+        if any(isinstance(node, ast.ImportFrom) and
+               node.module == '__future__' for node in tree.body):
+            # Let the compiler tell which features are really enabled
+            for name in __future__.all_feature_names:
+                feature = getattr(__future__, name)
+                if code.co_flags & feature.compiler_flag:
+                    self.flags |= feature.compiler_flag
+        return tree
+
+
+def _needs_compiling(source, tree):
+    # Whether the statement may have an error only found compiling it. The
+    # words looked for are in every statement with one (in any version),
+    # but functions (and classes of them) only returning are left out.
+    if '*' in source and STARRED_RE.search(source) or \
+            ('\t' in source or ' ' * 19 in source) and \
+            DEEP_INDENT_RE.search(source):
+        return True
+    names = KEYWORD_ARGUMENT_RE.findall(source)
+    if len(set(names)) < len(names):
+        return True
+    words = [word for word in COMPILER_CHECKED_WORDS if word in source]
+    if not words:
+        return False
+    if not set(words) <= set(['class', 'def', 'return']) or \
+            len(tree.body) != 1:
+        return True
+    statement = tree.body[0]
+    if isinstance(statement, ast.ClassDef) and source.count('class') == 1:
+        functions = [node for node in statement.body
+                     if isinstance(node, ast.FunctionDef)]
+        if 'return' in words and not all(
+                isinstance(node, SIMPLE_STATEMENT_TYPES)
+                for node in statement.body if node not in functions):
+            return True
+    elif isinstance(statement, ast.FunctionDef) and 'class' not in words:
+        functions = [statement]
+    else:
+        return True
+    if len(functions) != source.count('def') or \
+            getattr(statement, 'type_params', None):
+        return True
+    for function in functions:
+        arguments = getattr(function.args, 'posonlyargs', []) + \
+            function.args.args
+        names = [getattr(argument, 'arg', getattr(argument, 'id', None))
+                 for argument in arguments]
+        if None in names or len(set(names)) < len(names) or \
+                getattr(function, 'type_params', None):
+            return True
+    return False
+
+
+class StatementInfo(object):
+    # A statement stored in a StatementTable. Its text and prompts are built
+    # from the table only when they are needed.
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    @property
+    def line_number(self):
+        return self._table.line_numbers[self._index]
+
+    @property
+    def first_line(self):
+        return self._table.first_lines[self._index]
+
+    @property
+    def code(self):
+        return self._table.get_code(self._index)
+
+    @property
+    def lines(self):
+        return self._table.statement_lines(self._index)
+
+    @property
+    def statement(self):
+        return ''.join(self.lines)
+
+    @property
+    def prompts(self):
+        return line_prompts(self.lines, self.first_line)
+
+    def __repr__(self):
+        return 'StatementInfo(line_number={!r}, statement={!r}, ' \
+            'first_line={!r})'.format(self.line_number, self.statement,
+                                      self.first_line)
+
+
+class StatementTable(object):
+    # The statements of a script, stored as columns: The source is kept
+    # as a single string along with the offset where every line starts,
+    # and statements are just ranges of lines. It can be filled in the
+    # background, so the first statements can be used while the rest are
+    # being parsed, and any access waits only for the statements involved.
+    #
+    # Statements whose code is False are compiled when needed and kept in a
+    # LRU cache holding up to `code_cache_size` code objects (if not None).
+    COLUMNS = ('line_offsets', 'rows', 'line_counts', 'first_lines',
+               'line_numbers', 'future_flags')
+
+    def __init__(self, source_lines=(), code_cache_size=None):
+        self._set_source(source_lines)
+        self.base_line_number = 0
+        self.rows = array.array('l')
+        self.line_counts = array.array('l')
+        self.first_lines = array.array('l')
+        self.line_numbers = array.array('l')
+        self.future_flags = array.array('l')
+        self.codes = []
+        self.code_cache_size = code_cache_size
+        self._code_cache = OrderedDict()
+        self._ready = threading.Condition()
+        self._done = True
+        self._error = None
+
+    def append(self, row, line_count, first_line, line_number, code,
+               future_flags=0):
+        self.rows.append(row)
+        self.line_counts.append(line_count)
+        self.first_lines.append(first_line)
+        self.line_numbers.append(line_number)
+        self.future_flags.append(future_flags)
+        self.codes.append(code)
+
+    def _set_source(self, source_lines):
+        self.source = ''.join(source_lines)
+        self.line_offsets = array.array('l', [0])
+        offset = 0
+        for line in source_lines:
+            offset += len(line)
+            self.line_offsets.append(offset)
+
+    def source_lines(self):
+        return LINE_RE.findall(self.source)
+
+    def replace(self, source_lines, first, last, records, row_delta):
+        # Replace the statements from `first` to `last` (not included) with
+        # the given ones, for a new source where the statements after them
+        # have moved `row_delta` lines.
+        records = list(records)
+        fields = list(zip(*records)) or [()] * 6
+        with self._ready:
+            self._set_source(source_lines)
+            for name, values in zip(('rows', 'line_counts', 'first_lines',
+                                     'line_numbers'), fields):
+                getattr(self, name)[first:last] = array.array('l', values)
+            self.future_flags[first:last] = array.array('l', fields[5])
+            self.codes[first:last] = fields[4]
+            for index in range(first + len(records), len(self.codes)):
+                self.rows[index] += row_delta
+                self.line_numbers[index] += row_delta
+            if self.codes and self.first_lines[-1] == -1:
+                # Trailing comments take the line number of the statement
+                # before them.
+                self.line_numbers[-1] = self.line_numbers[-2] \
+                    if len(self.codes) > 1 else self.base_line_number
+            self._code_cache.clear()
+
+    def get_code(self, index):
+        code = self.codes[index]
+        if code is not False:
+            return code
+        if index in self._code_cache:
+            code = self._code_cache.pop(index)
+        else:
+            compiler = codeop.CommandCompiler()
+            compiler.compiler.flags |= self.future_flags[index]
+            statement = ''.join(self.statement_lines(index))
+            code, _ = compile_statement(compiler, statement)
+        self._code_cache[index] = code
+        if self.code_cache_size is not None and \
+                len(self._code_cache) > self.code_cache_size:
+            self._code_cache.popitem(last=False)
+        return code
+
+    def fill(self, records, callback=None):
+        for record in records:
+            self.append(*record)
+        if callback is not None:
+            callback(self)
+
+    def fill_in_background(self, records, callback=None):
+        self._done = False
+        thread = threading.Thread(target=self._fill, args=(records, callback))
+        thread.daemon = True
+        thread.start()
+
+    def _fill(self, records, callback):
+        try:
+            for record in records:
+                with self._ready:
+                    self.append(*record)
+                    self._ready.notify_all()
+        except Exception as exc:
+            self._error = exc
+        finally:
+            with self._ready:
+                self._done = True
+                self._ready.notify_all()
+        if callback is not None and self._error is None:
+            callback(self)
+
+    @property
+    def done(self):
+        return self._done
+
+    def after_fork(self):
+        # Other threads don't exist in a forked process, so any lock they
+        # held would be never released.
+        self._ready = threading.Condition()
+
+    def wait_for(self, count=None):
+        """
+        Wait until there are at least `count` statements (or all of them, if
+        `count` is None) and return how many statements are available.
+        """
+        with self._ready:
+            while not self._done and (count is None or
+                                      len(self.codes) < count):
+                self._ready.wait()
+            if self._done and self._error is not None:
+                raise self._error
+            return len(self.codes)
+
+    def statement_lines(self, index):
+        offsets = self.line_offsets
+        row = self.rows[index]
+        end = row + self.line_counts[index]
+        source_end = len(offsets) - 1
+        lines = [self.source[offsets[line]:offsets[line + 1]]
+                 for line in range(row, min(end, source_end))]
+        lines.extend(['\n'] * (end - source_end))
+        return lines
+
+    def texts(self, start=0):
+        """
+        Return the text of the statements available from `start` on, all
+        taken at once so they're consistent even if the table is replaced
+        meanwhile.
+        """
+        with self._ready:
+            return [''.join(self.statement_lines(index))
+                    for index in range(start, len(self.codes))]
+
+    def __len__(self):
+        return self.wait_for()
+
+    def __getitem__(self, index):
+        count = self.wait_for(index + 1 if index >= 0 else None)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError('statement index out of range')
+        return StatementInfo(self, index)
+
+    def __iter__(self):
+        index = 0
+        while index < self.wait_for(index + 1):
+            yield StatementInfo(self, index)
+            index += 1
+
+
+def line_prompts(lines, first_line):
+    # Every line is typed after the prompt the interactive shell would show:
+    # Comments make it ask for more lines (while empty lines don't), and so
+    # does any line of a statement after the first one.
+    prompts = []
+    statement_started = False
+    for index, line in enumerate(lines):
+        prompts.append('ps2' if statement_started else 'ps1')
+        if 0 <= first_line <= index or line.startswith('#'):
+            statement_started = True
+        elif not line.strip():
             statement_started = False
-            statement_current_line = statement_first_line = -1
-            statement = ''
-            prompts = []
-
-    if statement:
-        if prompts[-1] == 'ps2':
-            statement += '\n'
-            prompts.append('ps2')
+    return prompts
+
+
+def join_lines(source_lines, row, line_count):
+    # Statements at the end of the file may need an extra empty line.
+    end = row + line_count
+    return ''.join(source_lines[row:end]) + \
+        '\n' * max(0, end - len(source_lines))
+
+
+def _last_statement(compiler, source_lines, start, first_line, line_number):
+    line_count = len(source_lines) - start
+    prompts = line_prompts(source_lines[start:], first_line)
+    if prompts[-1] == 'ps2':
+        line_count += 1
+    statement = join_lines(source_lines, start, line_count)
+    code, _ = compile_statement(compiler, statement)
+    return start, line_count, first_line, line_number, code
+
+
+class _LineScanner(object):
+    # Tokenizes the source lazily from the given line, recording:
+    #  - The lines ending outside brackets, strings and continuations.
+    #  - The last line of every simple statement, mapped to its first one.
+    #  - The comment lines outside any indented block, which end a compound
+    #    statement written in a single line (like `if x: y`) for the shell.
+    # Lines from `scanned` on are unknown if tokenizing failed.
+
+    def __init__(self, source_lines, start):
+        self.closed_lines = set()
+        self.simple_ends = {}
+        self.outer_comments = set()
+        self.scanned = start
+        self.failed = False
+        self._start = start
+        self._depth = 0
+        self._indent = 0
+        self._first_row = self._first_text = self._last_text = None
+        lines = iter(source_lines[start:])
+        self._tokens = tokenize.generate_tokens(lambda: next(lines, ''))
+
+    def scan_to(self, line):
+        try:
+            while not self.failed and self.scanned <= line:
+                self._process(*next(self._tokens)[:3])
+        except (StopIteration, tokenize.TokenError, SyntaxError):
+            self.failed = True
+
+    def _process(self, token_type, text, start):
+        row = start[0] + self._start - 1
+        if token_type in (tokenize.NEWLINE, tokenize.NL):
+            if self._depth == 0:
+                self.closed_lines.add(row)
+                self.scanned = row + 1
+            if token_type == tokenize.NEWLINE:
+                if self._first_text not in COMPOUND_KEYWORDS and \
+                        self._last_text != ':':
+                    self.simple_ends[row] = self._first_row
+                self._first_row = None
+        elif token_type == tokenize.ERRORTOKEN:
+            self.failed = True
+        elif token_type == tokenize.INDENT:
+            self._indent += 1
+        elif token_type == tokenize.DEDENT:
+            self._indent -= 1
+        elif token_type == tokenize.COMMENT:
+            if self._first_row is None and self._depth == 0 and \
+                    self._indent <= 0:
+                self.outer_comments.add(row)
+        elif token_type not in NON_CODE_TOKENS:
+            if self._first_row is None:
+                self._first_row, self._first_text = row, text
+            self._last_text = text
+            if text in ('(', '[', '{'):
+                self._depth += 1
+            elif text in (')', ']', '}'):
+                self._depth -= 1
+                self.failed = self._depth < 0
+
+
+def _may_end_statement(source_lines, first, last, scanner):
+    scanner.scan_to(last)
+    if last >= scanner.scanned or last + 1 == len(source_lines):
+        return True
+    if last not in scanner.closed_lines:
+        return False
+    line = source_lines[last].strip()
+    if not line or scanner.simple_ends.get(last) == first or \
+            last in scanner.outer_comments:
+        return True
+    if last == first and line.startswith('#'):
+        return True
+    # A compound statement may end before a non indented line
+    next_line = source_lines[last + 1]
+    return next_line[:1] not in BLOCK_LINE_STARTS and \
+        not BLOCK_CONTINUATION_RE.match(next_line)
+
+
+def _find_statement_end(compiler, source_lines, start, first, last):
+    for line in range(first, last):
+        statement = ''.join(source_lines[start:line + 1])
         code, compiled = compile_statement(compiler, statement)
-        statements.append(StatementInfo(statement_line_number, statement,
-                          prompts, statement_first_line, code))
-    return statements
+        if compiled:
+            return line, code
+    return last, None
 
 
 def read_source_code(filename):
-    with open(filename, 'rUb') as source_file:
-        stripped_source = source_file.read().rstrip() + b'\n'
-        source_lines = stripped_source.splitlines()
+    # The file is mapped in memory and decoded in chunks, in a single pass.
+    with open_source(filename) as source:
+        return decode_source(source)
 
-    if not source_lines:
-        return source_lines
+
+@contextmanager
+def open_source(filename):
+    # Give the bytes of the file, mapped in memory while they're used.
+    with open(filename, 'rb') as source_file:
+        try:
+            source = mmap.mmap(source_file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # Empty files can't be mapped
+            source = source_file.read()
+        try:
+            yield source
+        finally:
+            if isinstance(source, mmap.mmap):
+                source.close()
+
+
+def decode_source(source):
+    start = 0
+    end = len(source)
+    while end > 0 and source[end - 1:end] in WHITESPACE_BYTES:
+        end -= 1
 
     encoding = 'utf-8'
-    bom_found = source_lines[0].startswith(codecs.BOM_UTF8)
+    bom_found = source[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8
     if bom_found:
-        source_lines[0] = source_lines[0][len(codecs.BOM_UTF8):]
+        start = len(codecs.BOM_UTF8)
+
+    head_end = start
+    for _ in range(2):
+        match = NEWLINE_BYTES_RE.search(source, head_end, end)
+        head_end = match.end() if match else end
 
-    for line in source_lines[:2]:
+    for line in source[start:head_end].splitlines():
         try:
             # If the line is an encoding declaration, it must be ASCII.
             # If is not, it must be UTF-8 (the default encoding).
@@ -104,27 +770,53 @@ def read_source_code(filename):
             break
 
     output_encoding = sys.stdout.encoding
-    source_code = []
-    for line in source_lines:
+    decoder = codecs.getincrementaldecoder(encoding)()
+    parts = []
+    for offset in range(start, end, DECODING_CHUNK_SIZE):
+        chunk_end = min(offset + DECODING_CHUNK_SIZE, end)
+        state = decoder.getstate()
+        pending = len(state[0])
         try:
-            decoded_line = (line + b'\n').decode(encoding)
+            text = decoder.decode(source[offset:chunk_end], chunk_end == end)
         except UnicodeDecodeError as exp:
+            # The text before the error could have an error too.
+            error_start = offset - pending + exp.start
+            decoder.setstate(state)
+            _check_printable(parts, decoder.decode(source[offset:error_start]),
+                             output_encoding, encoding)
+            prefix = source[start:error_start]
+            line, column = _line_and_column(prefix, b'\r', b'\n')
             msg = "'{}' codec can't decode byte on line {}, column {}".format(
-                exp.encoding, len(source_code) + 1, exp.start)
+                exp.encoding, line, column)
             raise SyntaxError(msg)
 
-        try:
-            # To test if the line can be printed on the console
-            decoded_line.encode(output_encoding)
-        except UnicodeEncodeError as exp:
-            msg = "the byte on line {}, column {} can't be printed " \
-                "(maybe using the wrong encoding '{}'?)".format(
-                len(source_code) + 1, exp.start + 1, encoding)
-            raise SyntaxError(msg)
+        _check_printable(parts, text, output_encoding, encoding)
+        parts.append(text)
 
-        source_code.append(decoded_line)
+    text = u''.join(parts)
+    del parts
+    text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n') + u'\n'
+    return LINE_RE.findall(text)
 
-    return source_code
+
+def _check_printable(parts, text, output_encoding, encoding):
+    # Test if the text following the parts can be printed on the console
+    try:
+        text.encode(output_encoding)
+    except UnicodeEncodeError as exp:
+        prefix = u''.join(parts) + text[:exp.start]
+        line, column = _line_and_column(prefix, u'\r', u'\n')
+        msg = "the byte on line {}, column {} can't be printed " \
+            "(maybe using the wrong encoding '{}'?)".format(
+            line, column + 1, encoding)
+        raise SyntaxError(msg)
+
+
+def _line_and_column(prefix, carriage_return, line_feed):
+    prefix = prefix.replace(carriage_return + line_feed, line_feed)
+    prefix = prefix.replace(carriage_return, line_feed)
+    column = len(prefix) - prefix.rfind(line_feed) - 1
+    return prefix.count(line_feed) + 1, column
 
 
 def strip_encoding_declaration(source_lines):
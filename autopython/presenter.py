@@ -4,9 +4,16 @@ from __future__ import print_function
 
 import codecs
 import os.path
+import signal
+import sys
+import tempfile
 
 from datetime import datetime
-from . import console, parser
+from . import cache, console, parser
+from .checkpoints import Checkpoints, CheckpointResumed
+from .interactions import TypingStopped
+from .replay import ReplayPlanner
+from .watcher import FileWatcher
 
 
 def lower_upper_key(char):
@@ -36,6 +43,15 @@ KEY_GOTO = lower_upper_key('g')
 KEY_SHELL = lower_upper_key('s')
 KEY_HELP = lower_upper_key('h') + ('?',)
 KEY_QUIT = lower_upper_key('q')
+# Keys stopping the statement being typed (Next only skips the typing).
+KEY_STOP_TYPING = KEY_PREV + KEY_GOTO + KEY_SHELL + KEY_HELP + KEY_QUIT
+
+# Statements with this comment aren't executed while typed, nor those
+# reading the terminal.
+NO_SPECULATION_MARKER = 'no-speculate'
+# Names used by the statements reading from the terminal.
+READING_NAMES = frozenset(['input', 'raw_input', 'getpass', 'stdin',
+                           'sys.stdin', 'sys.__stdin__'])
 
 
 COMMANDS_HELP = [
@@ -56,24 +72,59 @@ COMMANDS_HELP = [
 ]
 
 
+class _SpeculationCommitted(Exception):
+    # Raised in the process that executed a statement while it was typed,
+    # once it continues the presentation.
+    pass
+
+
 class Presenter(object):
     (BEFORE_TYPING, MORE_TYPING, BEFORE_EXECUTING, BEFORE_QUITING,
-     QUITING) = range(5)
+     QUITING, MORE_OUTPUT) = range(6)
 
     def __init__(self, shell, logging=False, paginate=True, context_lines=1,
-                 typing_delay=30):
+                 typing_delay=30, use_cache=True, cache_dir=None, jobs=1,
+                 code_cache_size=None, watch=False, max_typing_time=None,
+                 accelerate=False, checkpoint_interval=None,
+                 speculate=False):
         self._shell = shell
         self._logging = logging
         self._logger = None
         self._paginate = paginate
         self._context_lines = context_lines
         self._typing_delay = typing_delay
+        self._max_typing_time = max_typing_time
+        self._accelerate = accelerate
+        self._use_cache = use_cache
+        self._cache_dir = cache_dir
+        self._jobs = jobs
+        self._code_cache_size = code_cache_size
+        self._watch = watch
+        self._watcher = None
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoints = None
+        self._speculate = speculate
+        self._speculation = None
+        self._replay_planner = ReplayPlanner()
+        # Statements before it may have been left out when replaying them.
+        self._replayed_until = 0
         self._script_loaded = False
 
     def load_file(self, filename):
-        self._statements = parser.parse_file(filename)
+        if self._use_cache:
+            self._statements = cache.parse_file(
+                filename, self._cache_dir, stream=True, jobs=self._jobs,
+                code_cache_size=self._code_cache_size)
+        else:
+            self._statements = parser.parse_file(
+                filename, stream=True, jobs=self._jobs,
+                code_cache_size=self._code_cache_size)
         self._script_name = filename
         self._script_loaded = True
+        if self._watch:
+            if self._watcher is not None:
+                self._watcher.close()
+            self._watcher = FileWatcher(filename)
 
     def run(self):
         if not self._script_loaded:
@@ -81,32 +132,55 @@ class Presenter(object):
 
         self._begin()
         try:
-            while self._state != Presenter.QUITING:
-                try:
-                    key = console.getch()
-                except KeyboardInterrupt:
-                    continue
-                if key in KEY_NEXT:
-                    self._next()
-                elif key in KEY_PREV:
-                    self._prev()
-                elif key in KEY_REPEAT:
-                    self._repeat()
-                elif key in KEY_GOTO:
-                    self._go_to()
-                elif key in KEY_SHELL:
-                    self._interact()
-                elif key in KEY_HELP:
-                    self._help()
-                elif key in KEY_QUIT:
-                    self._quit()
+            with console.TerminalSession():
+                self._run_loop()
         finally:
             self._end()
 
+    def _run_loop(self):
+        while self._state != Presenter.QUITING:
+            try:
+                key = console.getch()
+            except KeyboardInterrupt:
+                continue
+            if self._watcher is not None and self._watcher.changed():
+                self._reload()
+            try:
+                self._handle_key(key)
+            except CheckpointResumed as resumed:
+                self._resume(resumed.target)
+            except _SpeculationCommitted:
+                pass
+
+    def _handle_key(self, key):
+        # Only Next keeps the statement being typed, or shows more output.
+        if key not in KEY_NEXT:
+            self._drop_speculation()
+            self._drop_more_output()
+        if key in KEY_NEXT:
+            self._next()
+        elif key in KEY_PREV:
+            self._prev()
+        elif key in KEY_REPEAT:
+            self._repeat()
+        elif key in KEY_GOTO:
+            self._go_to()
+        elif key in KEY_SHELL:
+            self._interact()
+        elif key in KEY_HELP:
+            self._help()
+        elif key in KEY_QUIT:
+            self._quit()
+
     def _begin(self):
         self._index = 0
+        self._replayed_until = 0
         self._state = Presenter.BEFORE_TYPING
         self._shell.begin()
+        self._shell.prepare(self._statements)
+        if (self._checkpoint_interval or self._speculate) and \
+                Checkpoints.available() and self._shell.supports_forking():
+            self._checkpoints = Checkpoints()
         self._start_logging()
 
     def _end(self):
@@ -119,40 +193,145 @@ class Presenter(object):
             reason = 'The End.'
         self._log(reason)
         self._end_logging()
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+        self._drop_speculation()
+        if self._checkpoints is not None:
+            self._checkpoints.discard()
+
+    def _reload(self):
+        try:
+            changes = parser.reparse_file(self._script_name, self._statements)
+        except (IOError, OSError, SyntaxError) as exc:
+            self._log('Reloading the script failed: {}'.format(exc))
+            return
+        if changes is None:
+            return
+        first, old_end, new_end = changes
+        self._shell.prepare(self._statements)
+        self._drop_speculation()
+        if self._checkpoints is not None:
+            # They have the script as it was.
+            self._checkpoints.detach()
+        self._log('Script reloaded (statements {} to {} changed).'.format(
+                  first + 1, new_end))
+        # Keep pointing to the same statement, or to the first one after
+        # the changed ones if it was changed.
+        if self._index >= old_end:
+            self._index += new_end - old_end
+        elif self._index >= first:
+            if self._state in (Presenter.MORE_TYPING,
+                               Presenter.BEFORE_EXECUTING):
+                self._shell.control_c()
+                self._state = Presenter.BEFORE_TYPING
+            self._index = min(self._index, new_end)
 
     def _next(self):
         if self._state == Presenter.BEFORE_TYPING:
-            if self._index < len(self._statements):
+            if self._index < self._statements.wait_for(self._index + 1):
                 info = self._statements[self._index]
                 index = self._index + 1
-                lines = info.statement.splitlines()[info.first_line:]
+                lines = info.lines[info.first_line:]
                 self._log('Showing statement {} (on line {}):'.format(index,
                           info.line_number),
                           *(' ' + line for line in lines if line.strip()))
-                more = self._shell.show(info.statement, info.prompts, index,
-                                        info.first_line, self._typing_delay,
-                                        self._paginate, self._context_lines)
+                self._start_speculation(info)
+                try:
+                    more = self._shell.show(
+                        info.statement, info.prompts, index, info.first_line,
+                        self._typing_delay, self._paginate,
+                        self._context_lines, self._max_typing_time,
+                        self._accelerate, KEY_NEXT, KEY_STOP_TYPING)
+                except TypingStopped:
+                    self._typing_stopped()
+                    return
                 self._paginate
                 if more:
                     self._state = Presenter.MORE_TYPING
                 else:
                     self._state = Presenter.BEFORE_EXECUTING
+                    self._log_typing_speed()
             else:
                 self._quit()
         elif self._state == Presenter.MORE_TYPING:
-            if not self._shell.show_more():
+            try:
+                more = self._shell.show_more()
+            except TypingStopped:
+                self._typing_stopped()
+                return
+            if not more:
                 self._state = Presenter.BEFORE_EXECUTING
+                self._log_typing_speed()
         elif self._state == Presenter.BEFORE_EXECUTING:
+            if self._speculation is not None and \
+                    self._speculation.index == self._index:
+                self._commit_speculation()
+                return
             info = self._statements[self._index]
             self._index += 1
             motive = 'Failing on' if info.code is None else 'Executing'
             self._log('{} statement {} (on line {}).'.format(motive,
                       self._index, info.line_number))
-            self._shell.execute(info.statement, info.code)
-            self._state = Presenter.BEFORE_TYPING
+            # The executed code may read from the terminal.
+            with console.suspend_session():
+                completed = self._shell.execute(info.statement, info.code)
+            if completed is False:
+                self._restore_session(self._index - 1)
+            self._executed()
+            self._checkpoint()
+        elif self._state == Presenter.MORE_OUTPUT:
+            if not self._shell.show_more_output():
+                self._state = Presenter.BEFORE_TYPING
         elif self._state == Presenter.BEFORE_QUITING:
             self._state = Presenter.QUITING
 
+    def _executed(self):
+        # The rest of the output is shown pressing Next.
+        if self._shell.has_more_output():
+            self._state = Presenter.MORE_OUTPUT
+        else:
+            self._state = Presenter.BEFORE_TYPING
+
+    def _drop_more_output(self):
+        if self._state == Presenter.MORE_OUTPUT:
+            self._shell.drop_more_output()
+            self._state = Presenter.BEFORE_TYPING
+
+    def _restore_session(self, end):
+        # The interpreter was restarted, so the statements before `end` that
+        # the rest of them need are executed again.
+        needed = self._replay_planner.plan(self._statements, 0, end)
+        if needed is None:
+            needed = range(end)
+        else:
+            self._replayed_until = max(self._replayed_until, end)
+        self._log('Interpreter restarted, executing again {} of the {} '
+                  'statements before.'.format(len(needed), end))
+        for index in sorted(needed):
+            # Quietly, like on Go To, but for those reading the terminal.
+            info = self._statements[index]
+            if self._replay_planner.uses_any(self._statements, index,
+                                             READING_NAMES):
+                self._shell.show(info.statement, info.prompts, index + 1,
+                                 info.first_line)
+                with console.suspend_session():
+                    completed = self._shell.execute(info.statement,
+                                                    info.code)
+                self._shell.drop_more_output()
+            else:
+                completed = self._shell.execute(info.statement, info.code,
+                                                quiet=True)
+            if completed is False:
+                self._log('Interpreter restarted again on statement '
+                          '{}.'.format(index + 1))
+                break
+
+    def _typing_stopped(self):
+        # The key stopping it is read next.
+        self._shell.control_c()
+        self._state = Presenter.BEFORE_TYPING
+
     def _prev(self):
         if self._state in (Presenter.BEFORE_TYPING, Presenter.MORE_TYPING,
                            Presenter.BEFORE_EXECUTING):
@@ -166,7 +345,7 @@ class Presenter(object):
         elif self._state == Presenter.BEFORE_QUITING:
             self._shell.control_c()
             self._state = Presenter.BEFORE_TYPING
-            if self._index == len(self._statements):
+            if self._index == self._statements.wait_for(self._index + 1):
                 self._index -= 1
             if self._index > 0:
                 self._next()
@@ -184,34 +363,181 @@ class Presenter(object):
             self._next()
 
     def _go_to(self):
-        if not self._statements:
+        if not self._statements.wait_for(1):
             return
         if self._state in (Presenter.MORE_TYPING, Presenter.BEFORE_EXECUTING,
                            Presenter.BEFORE_QUITING):
             self._shell.control_c()
             self._state = Presenter.BEFORE_TYPING
 
-        new_index = self._shell.ask_where_to_go(len(self._statements))
+        with console.suspend_session():
+            new_index = self._shell.ask_where_to_go(
+                self._statements.wait_for)
         if new_index is None:
             return
         self._log('Continuing on statement {} (line {}).'.format(
                   new_index + 1, self._statements[new_index].line_number))
+        self._fast_forward(new_index)
+
+    def _fast_forward(self, new_index):
         if new_index < self._index:
+            if self._checkpoints is not None:
+                # Unless there's no checkpoint before it, the process
+                # resumed continues the presentation instead of this one.
+                self._flush()
+                new_index = self._checkpoints.go_back(new_index)
             self._shell.reset_interpreter()
             self._index = 0
+            self._replayed_until = 0
         if new_index > 0:
-            try:
-                original_typing_delay = self._typing_delay
-                self._typing_delay = 0
-                original_logging = self._logging
-                self._logging = False
-                while self._index < new_index:
-                    self._next()
-            finally:
-                self._typing_delay = original_typing_delay
-                self._logging = original_logging
+            needed = self._replay_planner.plan(self._statements, self._index,
+                                               new_index)
+            if needed is not None and new_index > self._index:
+                self._log('Executing only {} of the {} statements before '
+                          'it.'.format(len(needed), new_index - self._index))
+                self._replayed_until = max(self._replayed_until, new_index)
+            while self._index < new_index:
+                if needed is None or self._index in needed:
+                    self._execute_quietly()
+                else:
+                    self._index += 1
         self._next()
 
+    def _execute_quietly(self):
+        # Without showing the statement nor its output, but for those
+        # reading the terminal (even through the functions of the script),
+        # which are shown (without typing them) as they wouldn't read
+        # anything otherwise. Those that can't be analyzed are executed
+        # quietly too.
+        info = self._statements[self._index]
+        reads_input = self._replay_planner.uses_any(
+            self._statements, self._index, READING_NAMES)
+        self._index += 1
+        if not reads_input:
+            completed = self._shell.execute(info.statement, info.code,
+                                            quiet=True)
+        else:
+            self._shell.show(info.statement, info.prompts, self._index,
+                             info.first_line)
+            with console.suspend_session():
+                completed = self._shell.execute(info.statement, info.code)
+            self._shell.drop_more_output()
+        if completed is False:
+            self._restore_session(self._index - 1)
+        self._checkpoint()
+
+    def _checkpoint(self):
+        # Taken every `checkpoint_interval` statements and before sections
+        # (statements after a comment starting with ##). The forked process
+        # can't wait for statements still being parsed, and the statements
+        # left out when replaying may be needed going back before where
+        # the replay ended.
+        if not self._checkpoint_interval or self._checkpoints is None or \
+                self._index in self._checkpoints or \
+                self._index < self._replayed_until or \
+                not self._statements.done:
+            return
+        at_section = False
+        if self._index < len(self._statements):
+            info = self._statements[self._index]
+            at_section = any(line.lstrip().startswith('##')
+                             for line in info.lines[:info.first_line])
+        if self._index % self._checkpoint_interval and not at_section:
+            return
+        self._flush()
+        target = self._checkpoints.take(self._index)
+        if target is not None:
+            raise CheckpointResumed(target)
+
+    def _start_speculation(self, info):
+        # Execute the statement in a forked process while it's typed, which
+        # continues the presentation if it's executed.
+        self._drop_speculation()
+        if not self._speculate or self._checkpoints is None or \
+                not self._typing_delay or not self._statements.done or \
+                any(NO_SPECULATION_MARKER in line for line in info.lines):
+            return
+        # Statements reading from the terminal (even through the functions
+        # of the script), or that can't be analyzed, aren't speculated.
+        if self._replay_planner.uses_any(self._statements, self._index,
+                                         READING_NAMES) is not False:
+            return
+        self._flush()
+        self._speculation = self._checkpoints.fork(self._index)
+        if self._speculation is None:
+            self._speculate_statement(info)
+
+    def _speculate_statement(self, info):
+        # In the forked process. Ctrl-C interrupts the statement only once
+        # the parent hands the presentation over, sending SIGUSR1.
+        handed_over = []
+
+        def interrupt(signum, frame):
+            if handed_over:
+                raise KeyboardInterrupt()
+
+        signal.signal(signal.SIGUSR1, lambda signum, frame:
+                      handed_over.append(True))
+        signal.signal(signal.SIGINT, interrupt)
+        self._statements.after_fork()
+        self._shell.after_fork(self._statements)
+        output = tempfile.TemporaryFile()
+        try:
+            with console.redirect_output(output):
+                self._shell.execute(info.statement, info.code)
+        finally:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+        if not self._checkpoints.wait_for_hand_over():
+            os._exit(0)
+        output.seek(0)
+        data = output.read()
+        output.close()
+        while data:
+            data = data[os.write(sys.stdout.fileno(), data):]
+        console.discard_keys()
+        self._index += 1
+        self._executed()
+        self._log('Executed statement {} (on line {}) while typing it.'.format(
+                  self._index, info.line_number))
+        self._checkpoint()
+        raise _SpeculationCommitted()
+
+    def _commit_speculation(self):
+        speculation, self._speculation = self._speculation, None
+        self._flush()
+        target = self._checkpoints.hand_over(speculation)
+        # The forked process had to go back before it was forked.
+        self._state = Presenter.BEFORE_TYPING
+        self._fast_forward(target)
+
+    def _drop_speculation(self):
+        if self._speculation is not None:
+            self._checkpoints.drop(self._speculation)
+            self._speculation = None
+
+    def _resume(self, target):
+        # This process is a checkpoint taken before, going to `target` in
+        # place of the process that resumed it.
+        console.discard_keys()
+        # The rest of the output it had is another's.
+        self._state = Presenter.BEFORE_TYPING
+        self._statements.after_fork()
+        self._shell.after_fork(self._statements)
+        while True:
+            try:
+                self._fast_forward(target)
+                return
+            except CheckpointResumed as resumed:
+                target = resumed.target
+
+    def _flush(self):
+        # Nothing buffered must be written twice (or lost) by forking or
+        # exiting right away.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if self._logger is not None:
+            self._logger.flush()
+
     def _interact(self):
         if self._state in (Presenter.MORE_TYPING, Presenter.BEFORE_EXECUTING,
                            Presenter.BEFORE_QUITING):
@@ -219,10 +545,12 @@ class Presenter(object):
             self._state = Presenter.BEFORE_TYPING
         if self._state == Presenter.BEFORE_TYPING:
             self._log('Entering interactive mode.')
-            for statement in self._shell.interact():
-                lines = [' ' + line for line in statement if line.strip()]
-                if lines:
-                    self._log('Executing:', *lines)
+            with console.suspend_session():
+                for statement in self._shell.interact():
+                    lines = [' ' + line for line in statement
+                             if line.strip()]
+                    if lines:
+                        self._log('Executing:', *lines)
             self._log('Leaving interactive mode.')
 
     def _help(self):
@@ -242,6 +570,12 @@ class Presenter(object):
             self._shell.quit()
             self._state = Presenter.BEFORE_QUITING
 
+    def _log_typing_speed(self):
+        speed = self._shell.typing_speed()
+        if speed is not None:
+            self._log('Typed at {:.1f} characters per second ({:.1f} '
+                      'requested).'.format(*speed))
+
     def _start_logging(self):
         if self._logging:
             if self._logger is not None:
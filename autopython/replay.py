@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+import ast
+import sys
+
+# Calls to these names only read their arguments (but iterators, which are
+# rarely kept in a variable to be used again).
+READING_CALLS = frozenset([
+    'print', 'len', 'repr', 'str', 'type', 'isinstance', 'issubclass', 'id',
+    'hash', 'dir', 'help', 'callable', 'hasattr', 'getattr', 'abs', 'ascii',
+    'bin', 'chr', 'hex', 'oct', 'ord', 'bool', 'int', 'float', 'complex',
+    'format', 'round', 'divmod', 'pow', 'sum', 'min', 'max', 'any', 'all',
+    'sorted', 'list', 'tuple', 'set', 'frozenset', 'dict', 'range',
+    'enumerate', 'zip', 'reversed', 'bytes', 'bytearray', 'object',
+])
+# Names that can read or change any variable, so the statements using them
+# can't be analyzed.
+OPAQUE_NAMES = frozenset([
+    'exec', 'eval', 'globals', 'locals', 'vars', '__import__', '__builtins__',
+    'execfile', 'reload',
+])
+if sys.version_info >= (3, 8):
+    _CONSTANTS = (ast.Constant,)
+else:
+    _CONSTANTS = tuple(getattr(ast, name) for name in
+                       ('Num', 'Str', 'Bytes', 'NameConstant')
+                       if hasattr(ast, name))
+
+
+class StatementEffects(object):
+    # The variables a statement may change (`defines`), those it may read
+    # (`uses`), those the code it leaves to run later may read whenever it
+    # runs (`deferred_uses`, like the variables used in the body of the
+    # functions it defines) and whether it may do anything else (`impure`),
+    # like calling functions defined by the script or changing an object,
+    # which could be held by any other variable.
+    __slots__ = ('defines', 'uses', 'deferred_uses', 'impure')
+
+    def __init__(self, defines=(), uses=(), deferred_uses=(), impure=False):
+        self.defines = frozenset(defines)
+        self.uses = frozenset(uses)
+        self.deferred_uses = frozenset(deferred_uses)
+        self.impure = impure
+
+
+class _EffectsVisitor(ast.NodeVisitor):
+    class Opaque(Exception):
+        pass
+
+    def __init__(self):
+        self.defines = set()
+        self.uses = set()
+        self.deferred_uses = set()
+        self.impure = False
+        # Variables assigned inside functions and classes are local to them,
+        # and the code of functions isn't run until they're called. That of
+        # generator expressions runs as they're consumed, but also now.
+        self._depth = 0
+        self._deferred = 0
+        self._lazy = 0
+
+    def visit_Name(self, node):
+        if node.id in OPAQUE_NAMES:
+            raise self.Opaque()
+        if isinstance(node.ctx, ast.Load):
+            self._use(node.id)
+        elif self._depth == 0:
+            self.defines.add(node.id)
+
+    def visit_FunctionDef(self, node):
+        self._define(node.name)
+        # Decorators can do anything with the function.
+        if node.decorator_list:
+            self._change()
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        # Default values and annotations are evaluated right away.
+        self._visit_arguments(node.args)
+        if getattr(node, 'returns', None) is not None:
+            self.visit(node.returns)
+        self._visit_nested(node.body, deferred=True)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self._visit_arguments(node.args)
+        self._visit_nested([node.body], deferred=True)
+
+    def visit_ClassDef(self, node):
+        self._define(node.name)
+        children = node.decorator_list + node.bases + \
+            getattr(node, 'keywords', [])
+        # Metaclasses and __init_subclass__ can do anything with the class.
+        if children:
+            self._change()
+        for child in children:
+            self.visit(child)
+        self._visit_nested(node.body)
+
+    def visit_GeneratorExp(self, node):
+        self.visit(node.generators[0].iter)
+        self._lazy += 1
+        try:
+            self.visit(node.elt)
+            for index, generator in enumerate(node.generators):
+                self.visit(generator.target)
+                if index > 0:
+                    self.visit(generator.iter)
+                for condition in generator.ifs:
+                    self.visit(condition)
+        finally:
+            self._lazy -= 1
+
+    def visit_Global(self, node):
+        if self._depth > 0:
+            raise self.Opaque()
+
+    visit_Nonlocal = visit_Global
+
+    def visit_Exec(self, node):
+        raise self.Opaque()
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self._define(alias.asname or alias.name.split('.')[0])
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            if alias.name == '*':
+                raise self.Opaque()
+            self._define(alias.asname or alias.name)
+
+    def visit_Expr(self, node):
+        # The interactive interpreter stores the value of expressions in _
+        self._define('_')
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node):
+        # The object may be changed in place.
+        self._change()
+        if isinstance(node.target, ast.Name) and not self._deferred:
+            self.uses.add(node.target.id)
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        if not isinstance(node.ctx, ast.Load):
+            self._change()
+        elif isinstance(node.value, ast.Name):
+            # Also used as a dotted name, like `sys.stdin`.
+            self._use(node.value.id + '.' + node.attr)
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        if not isinstance(node.ctx, ast.Load):
+            self._change()
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        # Methods may change their object, and anything but the builtins
+        # known to only read their arguments may change anything. Those
+        # builtins may also call the functions they're given, like the key
+        # of `sorted`, or write to a file.
+        function = node.func
+        if not isinstance(function, ast.Name) or \
+                function.id not in READING_CALLS or \
+                any(isinstance(argument, ast.Lambda)
+                    for argument in node.args) or \
+                any(not isinstance(keyword.value, _CONSTANTS)
+                    for keyword in node.keywords):
+            self._change()
+        self.generic_visit(node)
+
+    def _change(self):
+        if not self._deferred:
+            self.impure = True
+
+    def _use(self, name):
+        if self._deferred or self._lazy:
+            self.deferred_uses.add(name)
+        if not self._deferred:
+            self.uses.add(name)
+
+    def _define(self, name):
+        if self._depth == 0:
+            self.defines.add(name)
+
+    def _visit_arguments(self, arguments):
+        defaults = list(arguments.defaults) + \
+            [default for default in getattr(arguments, 'kw_defaults', ())
+             if default is not None]
+        for default in defaults:
+            self.visit(default)
+        for argument in getattr(arguments, 'posonlyargs', []) + \
+                arguments.args + getattr(arguments, 'kwonlyargs', []) + \
+                [arguments.vararg, arguments.kwarg]:
+            annotation = getattr(argument, 'annotation', None)
+            if annotation is not None:
+                self.visit(annotation)
+
+    def _visit_nested(self, body, deferred=False):
+        self._depth += 1
+        self._deferred += deferred
+        try:
+            for node in body:
+                self.visit(node)
+        finally:
+            self._depth -= 1
+            self._deferred -= deferred
+
+
+def analyze(statement, future_flags=0):
+    """
+    Return the StatementEffects of the source of a statement, or None if
+    they can't be known.
+    """
+    try:
+        tree = compile(statement, '<statement>', 'exec',
+                       ast.PyCF_ONLY_AST | future_flags, True)
+    except (OverflowError, SyntaxError, ValueError):
+        # It isn't executed at all.
+        return StatementEffects()
+    visitor = _EffectsVisitor()
+    try:
+        visitor.visit(tree)
+    except _EffectsVisitor.Opaque:
+        return None
+    return StatementEffects(visitor.defines, visitor.uses,
+                            visitor.deferred_uses, visitor.impure)
+
+
+class ReplayPlanner(object):
+    """
+    Chooses which statements must be executed to continue the presentation
+    from some statement, leaving out those only showing something, or
+    changing variables the rest of the script doesn't use.
+    """
+    def __init__(self):
+        self._effects = {}
+        self._users_key = self._users_names = None
+
+    def plan(self, statements, start, end):
+        """
+        Return the indexes of the statements from `start` to `end` (not
+        included) needed by the statements from `end` on, or None if all of
+        them must be executed.
+        """
+        if not statements.done:
+            return None
+        # The statements left may call any function of the script, which
+        # may use any variable used in any function.
+        live = set()
+        for index in range(len(statements)):
+            effects = self.effects(statements, index)
+            if effects is None:
+                return None
+            live.update(effects.deferred_uses)
+            if index >= end:
+                live.update(effects.uses)
+        needed = set()
+        for index in range(end - 1, start - 1, -1):
+            effects = self.effects(statements, index)
+            if effects is None:
+                return None
+            if effects.impure or not live.isdisjoint(effects.defines):
+                needed.add(index)
+                live.update(effects.uses)
+        return needed
+
+    def uses_any(self, statements, index, names):
+        """
+        Return whether a statement may use any of the given names, directly
+        or calling the functions of the script using them (or None if it
+        can't be known).
+        """
+        effects = self.effects(statements, index)
+        if effects is None:
+            return None
+        return not effects.uses.isdisjoint(
+            self._users(statements, frozenset(names)))
+
+    def _users(self, statements, names):
+        # The given names, and those defined by the statements of the script
+        # leaving code to run later which uses any of them.
+        key = statements.source, names
+        if self._users_key == key:
+            return self._users_names
+        users = set(names)
+        candidates = []
+        for index in range(statements.wait_for(0)):
+            effects = self.effects(statements, index)
+            if effects is not None and effects.deferred_uses:
+                candidates.append(effects)
+        changed = True
+        while changed:
+            changed = False
+            for effects in candidates:
+                if not effects.defines <= users and \
+                        not effects.deferred_uses.isdisjoint(users):
+                    users.update(effects.defines)
+                    changed = True
+        if statements.done:
+            self._users_key, self._users_names = key, users
+        return users
+
+    def effects(self, statements, index):
+        """Return the StatementEffects of a statement, as `analyze`."""
+        statement = statements[index].statement
+        key = statement, statements.future_flags[index]
+        if key not in self._effects:
+            self._effects[key] = analyze(*key)
+        return self._effects[key]
+
+
+__all__ = ['analyze', 'ReplayPlanner', 'StatementEffects']
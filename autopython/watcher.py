@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import os
+import struct
+import sys
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class FileWatcher(object):
+    """Tells whether a file changed since the last time it was asked."""
+
+    def __init__(self, filename):
+        self._filename = os.path.abspath(filename)
+        self._signature = self._get_signature()
+        self._notifier = None
+        if sys.platform.startswith('linux'):
+            self._notifier = _Inotify.create(self._filename)
+
+    def changed(self):
+        # Without inotify, the file is checked every time.
+        if self._notifier is not None and not self._notifier.touched():
+            return False
+        signature = self._get_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        return True
+
+    def close(self):
+        if self._notifier is not None:
+            self._notifier.close()
+            self._notifier = None
+
+    def _get_signature(self):
+        try:
+            stat = os.stat(self._filename)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+class _Inotify(object):
+    # The directory is watched instead of the file so editors replacing it
+    # with a new one are noticed too.
+
+    def __init__(self, fd, name):
+        self._fd = fd
+        self._name = name
+
+    @classmethod
+    def create(cls, filename):
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (ImportError, OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        directory, name = os.path.split(filename)
+        if not isinstance(directory, bytes):
+            directory = directory.encode(sys.getfilesystemencoding())
+            name = name.encode(sys.getfilesystemencoding())
+        if libc.inotify_add_watch(fd, directory, WATCH_MASK) < 0:
+            os.close(fd)
+            return None
+        return cls(fd, name)
+
+    def touched(self):
+        touched = False
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError as exc:
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name == self._name or mask & IN_Q_OVERFLOW:
+                    touched = True
+        return touched
+
+    def close(self):
+        os.close(self._fd)
+
+
+__all__ = ['FileWatcher']
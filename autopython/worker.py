@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+import marshal
+import os
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+
+from .compat import PY2, monotonic
+from .console import discard_output
+from .cpython import enable_completion, interact_with, make_interpreter
+from .pager import OutputPager
+
+# How long an interrupted statement has to stop before killing the process.
+INTERRUPT_GRACE = 2.0
+
+# Every message is a tuple (the kind of message and its arguments) dumped
+# with marshal, preceded by its size.
+_HEADER = struct.Struct('!I')
+
+
+def send_message(connection, *message):
+    data = marshal.dumps(message)
+    connection.sendall(_HEADER.pack(len(data)) + data)
+
+
+def receive_message(connection):
+    """Return the next message, or None if the connection was closed."""
+    header = _receive_exactly(connection, _HEADER.size)
+    if header is None:
+        return None
+    data = _receive_exactly(connection, _HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return marshal.loads(data)
+
+
+def _receive_exactly(connection, size):
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class InterpreterProcess(object):
+    """
+    An interpreter running in another process, so statements blocking the
+    interpreter, or crashing it, can be stopped by killing the process.
+
+    The process shares the terminal, where the statements write and read as
+    usual. While waiting for a statement, Ctrl-C (which interrupts it in the
+    process too) or running longer than `timeout` seconds interrupt it, and
+    if it doesn't stop soon, the process is replaced by a new one.
+
+    Another process is kept ready, so starting a new one doesn't wait for
+    Python to start. The output of the statements is paged in the process
+    (see OutputPager).
+    """
+    def __init__(self, color_scheme=None, timeout=None, max_output_lines=None,
+                 max_output_chars=None):
+        self._color_scheme = color_scheme
+        self._timeout = timeout
+        self._max_output_lines = max_output_lines
+        self._max_output_chars = max_output_chars
+        # Lines of the output of the last statement still to be shown.
+        self.pending_output = 0
+        self._process = None
+        self._connection = None
+        self._spare = None
+        # Processes stopped but maybe not ended yet.
+        self._ending = []
+        self._interrupted_at = None
+
+    @staticmethod
+    def available():
+        return os.name == 'posix'
+
+    def start(self):
+        self._stop()
+        if self._spare is None or self._spare[0].poll() is not None:
+            self._spare = self._spawn()
+        self._process, self._connection = self._spare
+        self._spare = self._spawn()
+        self.pending_output = 0
+
+    def _spawn(self):
+        connection, child_connection = socket.socketpair()
+        fd = child_connection.fileno()
+        args = [sys.executable, '-m', 'autopython.worker', str(fd),
+                self._color_scheme or '']
+        for limit in (self._max_output_lines, self._max_output_chars):
+            args.append('' if limit is None else str(limit))
+        # The process must find this package wherever the presenter is run.
+        package_dir = os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [package_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+        if PY2:
+            kwargs = {'close_fds': False}
+        else:
+            kwargs = {'pass_fds': [fd]}
+        process = subprocess.Popen(args, env=env, **kwargs)
+        child_connection.close()
+        return process, connection
+
+    def close(self):
+        self._stop()
+        if self._spare is not None:
+            self._spare[1].close()
+            self._ending.append(self._spare[0])
+            self._spare = None
+        deadline = monotonic() + INTERRUPT_GRACE
+        while any(p.poll() is None for p in self._ending) and \
+                monotonic() < deadline:
+            select.select([], [], [], 0.05)
+        for process in self._ending:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        self._ending = []
+
+    def _stop(self):
+        # Without connection, the process ends by itself.
+        if self._process is not None:
+            self._connection.close()
+            self._ending.append(self._process)
+            self._process = None
+            self._connection = None
+        self._ending = [p for p in self._ending if p.poll() is None]
+
+    def execute(self, statement, code=None, quiet=False):
+        """
+        Execute the statement, or its compiled code, returning False if the
+        process had to be restarted to stop it. When `quiet`, its output is
+        discarded.
+        """
+        if self._process is None:
+            self.start()
+        if code is not None:
+            send_message(self._connection, 'run', quiet, marshal.dumps(code))
+        else:
+            send_message(self._connection, 'compile', quiet, statement)
+        return self._wait_until_done() is not None
+
+    def show_more_output(self):
+        """Like `OutputPager.show_more`."""
+        send_message(self._connection, 'more')
+        self._wait_until_done(interruptible=False)
+        return self.pending_output > 0
+
+    def drop_more_output(self):
+        send_message(self._connection, 'drop')
+        self._wait_until_done(interruptible=False)
+
+    def _wait_until_done(self, interruptible=True):
+        message = self._wait(interruptible)
+        self.pending_output = message[1] if message is not None else 0
+        return message
+
+    def interact(self, ps1, ps2, interrupted):
+        """Yield the lines of every statement entered interactively."""
+        if self._process is None:
+            self.start()
+        send_message(self._connection, 'interact', ps1, ps2, interrupted)
+        while True:
+            # Ctrl-C is handled by the interactive session.
+            message = self._wait(interruptible=False)
+            if message is None or message[0] == 'done':
+                return
+            yield list(message[1])
+
+    def _wait(self, interruptible=True):
+        # Return the next message, or None if the process was restarted
+        # instead.
+        self._interrupted_at = None
+        deadline = None
+        if self._timeout is not None and interruptible:
+            deadline = monotonic() + self._timeout
+        previous_handler = signal.signal(
+            signal.SIGINT,
+            self._interrupted if interruptible else signal.SIG_IGN)
+        try:
+            while True:
+                ready = select.select([self._connection], [], [], 0.1)[0]
+                if ready:
+                    message = receive_message(self._connection)
+                    if message is not None:
+                        return message
+                    # The process died.
+                    break
+                now = monotonic()
+                if self._interrupted_at is None:
+                    if deadline is not None and now >= deadline:
+                        os.kill(self._process.pid, signal.SIGINT)
+                        self._interrupted_at = now
+                elif now >= self._interrupted_at + INTERRUPT_GRACE:
+                    break
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+        self._process.kill()
+        self.start()
+        return None
+
+    def _interrupted(self, signum, frame):
+        # The process in the same process group got SIGINT too.
+        if self._interrupted_at is None:
+            self._interrupted_at = monotonic()
+
+
+class Worker(object):
+    # The interpreter in the process, executing the statements sent by the
+    # InterpreterProcess through `connection`.
+    def __init__(self, connection, color_scheme=None, max_output_lines=None,
+                 max_output_chars=None):
+        self._connection = connection
+        self._interacting = False
+        self._interpreter = make_interpreter(self, color_scheme)
+        self._pager = OutputPager(max_output_lines, max_output_chars,
+                                  color_scheme)
+
+    def serve(self):
+        # Ctrl-C only interrupts the statements.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        while True:
+            message = receive_message(self._connection)
+            if message is None:
+                return
+            try:
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                try:
+                    self._handle(*message)
+                finally:
+                    signal.signal(signal.SIGINT, signal.SIG_IGN)
+            except KeyboardInterrupt:
+                pass
+            sys.stdout.flush()
+            sys.stderr.flush()
+            send_message(self._connection, 'done', self._pager.pending)
+
+    def _handle(self, kind, *args):
+        if kind in ('run', 'compile'):
+            quiet, data = args
+            if quiet:
+                with discard_output():
+                    self._execute(kind, data)
+            else:
+                with self._pager.capture():
+                    self._execute(kind, data)
+        elif kind == 'more':
+            self._pager.show_more()
+        elif kind == 'drop':
+            self._pager.drop()
+        elif kind == 'interact':
+            enable_completion(self._interpreter.locals)
+            self._interacting = True
+            try:
+                for lines in interact_with(self._interpreter, self, *args):
+                    send_message(self._connection, 'statement', lines)
+            finally:
+                self._interacting = False
+
+    def _execute(self, kind, data):
+        if kind == 'run':
+            self._interpreter.runcode(marshal.loads(data))
+        else:
+            self._interpreter.compilesource(data)
+
+
+def main():
+    connection = socket.fromfd(int(sys.argv[1]), socket.AF_UNIX,
+                               socket.SOCK_STREAM)
+    os.close(int(sys.argv[1]))
+    color_scheme = sys.argv[2] or None
+    max_output_lines, max_output_chars = [int(limit) if limit else None
+                                          for limit in sys.argv[3:5]]
+    # As in an interactive session.
+    sys.argv = ['']
+    Worker(connection, color_scheme, max_output_lines,
+           max_output_chars).serve()
+
+
+__all__ = ['InterpreterProcess']
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import marshal
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from autopython import cache
+
+SCRIPT = 'x = 1\ndef f(a):\n    return a + x\n\nprint(f(2))\n'
+
+
+def rows(table):
+    return [(info.line_number, info.statement, info.code is None)
+            for info in table]
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.filename = os.path.join(self.directory, 'script.py')
+        self.write(SCRIPT)
+        self.loaded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, source):
+        with open(self.filename, 'w') as script:
+            script.write(source)
+
+    def parse(self, code_cache_size=None):
+        # Returns the statements and whether they were in the cache.
+        def load_statements(cache_name, code_cache_size=None):
+            table = load(cache_name, code_cache_size)
+            self.loaded.append(table is not None)
+            return table
+
+        load = cache.load_statements
+        cache.load_statements = load_statements
+        try:
+            table = cache.parse_file(self.filename, self.cache_dir,
+                                     code_cache_size=code_cache_size)
+        finally:
+            cache.load_statements = load
+        return rows(table), self.loaded.pop()
+
+    def cache_files(self):
+        return [os.path.join(self.cache_dir, name)
+                for name in os.listdir(self.cache_dir)]
+
+    def test_hit(self):
+        for code_cache_size in (None, 8):
+            statements, hit = self.parse(code_cache_size)
+            self.assertFalse(hit)
+            self.assertEqual(self.parse(code_cache_size), (statements, True))
+        self.assertEqual(len(self.cache_files()), 2)
+
+    def test_script_changed(self):
+        self.parse()
+        self.write(SCRIPT.replace('x = 1', 'x = 10'))
+        statements, hit = self.parse()
+        self.assertFalse(hit)
+        self.assertEqual(statements[0][1], 'x = 10\n')
+        # Touching the script doesn't change its statements.
+        os.utime(self.filename, (0, 0))
+        self.assertTrue(self.parse()[1])
+
+    def test_python_changed(self):
+        self.parse()
+        version = sys.version
+        sys.version = version + ' (changed)'
+        try:
+            self.assertFalse(self.parse()[1])
+        finally:
+            sys.version = version
+        cache_format = cache.CACHE_FORMAT
+        cache.CACHE_FORMAT += 1
+        try:
+            self.assertFalse(self.parse()[1])
+        finally:
+            cache.CACHE_FORMAT = cache_format
+        self.assertTrue(self.parse()[1])
+
+    def test_broken_file(self):
+        statements, _ = self.parse()
+        cache_name, = self.cache_files()
+        with open(cache_name, 'rb') as cache_file:
+            data = cache_file.read()
+        for broken in (data[:len(data) // 2], b'', b'\xff' * 16,
+                       data[:8] + b'\x00' * (len(data) - 8),
+                       marshal.dumps((1, 2, 3, 4))):
+            with open(cache_name, 'wb') as cache_file:
+                cache_file.write(broken)
+            self.assertEqual(self.parse(), (statements, False))
+            # It's replaced with the statements parsed again.
+            self.assertEqual(self.parse(), (statements, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
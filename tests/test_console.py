@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import os
+import unittest
+
+from autopython import console
+from autopython.console import ESC, KeyDecoder
+
+
+def decode_keys(*reads):
+    # The keys read from the terminal, decoding the bytes like the session.
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    keys = KeyDecoder()
+    read_keys = []
+    for data in reads:
+        read_keys.append(keys.feed(decoder.decode(data)))
+    read_keys.append(keys.flush())
+    return read_keys
+
+
+class KeyDecoderTest(unittest.TestCase):
+    def test_plain_keys(self):
+        self.assertEqual(decode_keys(b'ab\n'), [['a', 'b', '\n'], []])
+
+    def test_split_sequences(self):
+        self.assertEqual(decode_keys(b'\x1b', b'[6~'),
+                         [[], [console.PGDN], []])
+        self.assertEqual(decode_keys(b'x\x1b[', b'5', b'~y'),
+                         [['x'], [], [console.PGUP, 'y'], []])
+        self.assertEqual(decode_keys(b'\x1bO', b'Pn'),
+                         [[], [[ESC, 'O', 'P'], 'n'], []])
+
+    def test_lone_escape(self):
+        self.assertEqual(decode_keys(b'\x1b'), [[], [ESC]])
+        self.assertEqual(decode_keys(b'\x1b\x1b[A'), [[ESC, console.UP], []])
+        # Esc pressed while typing a sequence's first characters.
+        self.assertEqual(decode_keys(b'\x1b['), [[], [ESC, '[']])
+
+    def test_multibyte_characters(self):
+        text = u'\xf1€'
+        data = text.encode('utf-8')
+        self.assertEqual(decode_keys(data[:1], data[1:3], data[3:]),
+                         [[], [u'\xf1'], [u'€'], []])
+        self.assertEqual(decode_keys(b'\x1b' + data[:1], data[1:2]),
+                         [[], [[ESC, u'\xf1']], []])
+
+
+@unittest.skipIf(os.name != 'posix', 'only for POSIX terminals')
+class ReadKeysTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.write_fd = os.pipe()
+        self.session = console.TerminalSession()
+        self.session._fd = fd
+        self.session._decoder = \
+            codecs.getincrementaldecoder('utf-8')('replace')
+
+    def tearDown(self):
+        os.close(self.session._fd)
+        os.close(self.write_fd)
+
+    def test_escape_timeout(self):
+        # The rest of the sequence doesn't come, so Esc was pressed.
+        os.write(self.write_fd, b'\x1b')
+        self.assertEqual(self.session.read_keys(), [ESC])
+        os.write(self.write_fd, b'\x1b[6~')
+        self.assertEqual(self.session.read_keys(), [console.PGDN])
+
+
+if __name__ == '__main__':
+    unittest.main()
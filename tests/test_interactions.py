@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from autopython import interactions
+from autopython.interactions import TypingSchedule
+
+
+class _Clock(object):
+    # Stands in for the time module, moving only when sleeping.
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class _Random(object):
+    # Every character takes the typing delay.
+    def random(self):
+        return 0.5
+
+
+class TypingScheduleTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = _Clock()
+        self.saved = (interactions.monotonic, interactions.time,
+                      interactions.random)
+        interactions.monotonic = self.clock.monotonic
+        interactions.time = self.clock
+        interactions.random = _Random()
+
+    def tearDown(self):
+        (interactions.monotonic, interactions.time,
+         interactions.random) = self.saved
+
+    def type_chars(self, schedule, count):
+        for _ in range(count):
+            schedule.wait()
+        sleeps, self.clock.sleeps = self.clock.sleeps, []
+        return [round(seconds, 6) for seconds in sleeps]
+
+    def test_deadlines(self):
+        schedule = TypingSchedule([2, 1], 100)
+        schedule.resume()
+        self.assertEqual(self.type_chars(schedule, 3), [0.1] * 3)
+        self.assertEqual([round(speed, 6) for speed in schedule.speed()],
+                         [10.0, 10.0])
+        # Characters beyond the schedule take the typing delay.
+        self.assertEqual(self.type_chars(schedule, 1), [0.1])
+
+    def test_late(self):
+        schedule = TypingSchedule([4], 100)
+        schedule.resume()
+        # Writing took longer than typing two characters.
+        self.clock.now += 0.25
+        self.assertEqual(self.type_chars(schedule, 4), [0.05, 0.1])
+
+    def test_pause(self):
+        schedule = TypingSchedule([3], 100)
+        schedule.resume()
+        self.assertEqual(self.type_chars(schedule, 1), [0.1])
+        schedule.pause()
+        self.clock.now += 2
+        schedule.pause()
+        self.clock.now += 3
+        schedule.resume()
+        schedule.resume()
+        # The time paused doesn't count.
+        self.assertEqual(self.type_chars(schedule, 2), [0.1, 0.1])
+        self.assertEqual([round(speed, 6) for speed in schedule.speed()],
+                         [10.0, 10.0])
+
+    def test_max_typing_time(self):
+        schedule = TypingSchedule([6, 4], 100, max_typing_time=0.5)
+        schedule.resume()
+        self.assertEqual(self.type_chars(schedule, 10), [0.05] * 10)
+        # Typing takes less already.
+        schedule = TypingSchedule([3], 100, max_typing_time=0.5)
+        schedule.resume()
+        self.assertEqual(self.type_chars(schedule, 3), [0.1] * 3)
+
+    def test_acceleration(self):
+        schedule = TypingSchedule([1] * 12, 100, accelerate=True)
+        schedule.resume()
+        factors = [max(interactions.ACCELERATION ** line,
+                       interactions.MIN_DELAY_FACTOR) for line in range(12)]
+        self.assertEqual(self.type_chars(schedule, 12),
+                         [round(0.1 * factor, 6) for factor in factors])
+        self.assertEqual(factors[-2:], [interactions.MIN_DELAY_FACTOR] * 2)
+
+    def test_acceleration_with_max_typing_time(self):
+        schedule = TypingSchedule([2, 2], 100, max_typing_time=0.1,
+                                  accelerate=True)
+        schedule.resume()
+        sleeps = self.type_chars(schedule, 4)
+        self.assertAlmostEqual(sum(sleeps), 0.1)
+        self.assertEqual(sleeps[0], sleeps[1])
+        self.assertAlmostEqual(sleeps[2] / sleeps[0],
+                               interactions.ACCELERATION, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
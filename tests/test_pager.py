@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+
+from autopython import console
+from autopython.compat import StringIO
+from autopython.pager import OutputPager
+
+
+def terminal_size(fallback=None):
+    return console.terminal_size(20, 10)
+
+
+class OutputPagerTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (sys.stdout, sys.stderr, console.get_terminal_size)
+        sys.stdout = sys.stderr = self.output = StringIO()
+        console.get_terminal_size = terminal_size
+
+    def tearDown(self):
+        sys.stdout, sys.stderr, console.get_terminal_size = self.saved
+
+    def written(self):
+        text = self.output.getvalue()
+        self.output.seek(0)
+        self.output.truncate()
+        return text
+
+    def page(self, pager, *texts):
+        with pager.capture():
+            for text in texts:
+                sys.stdout.write(text)
+        return self.written()
+
+    def test_line_limit(self):
+        pager = OutputPager(max_lines=3)
+        lines = ['line {}\n'.format(index) for index in range(8)]
+        self.assertEqual(self.page(pager, *lines),
+                         ''.join(lines[:3]) + '... 5 more lines')
+        self.assertTrue(pager.overflowing)
+        self.assertEqual(pager.pending, 5)
+        self.assertTrue(pager.show_more())
+        self.assertEqual(self.written(), '\r' + ' ' * 16 + '\r' +
+                         ''.join(lines[3:6]) + '... 2 more lines')
+        self.assertEqual(pager.pending, 2)
+        self.assertFalse(pager.show_more())
+        self.assertEqual(self.written(), '\r' + ' ' * 16 + '\r' +
+                         ''.join(lines[6:]))
+        self.assertEqual(pager.pending, 0)
+        self.assertFalse(pager.overflowing)
+
+    def test_wrapped_lines(self):
+        # Lines longer than the terminal take more than one.
+        pager = OutputPager(max_lines=3)
+        self.assertEqual(self.page(pager, 'a' * 50 + '\n', 'b\n'),
+                         'a' * 50 + '\n... 1 more line')
+        self.assertEqual(pager.pending, 1)
+        pager = OutputPager(max_lines=2)
+        self.assertEqual(self.page(pager, 'a' * 50 + '\n'),
+                         'a' * 40 + '\n... 1 more line')
+
+    def test_char_limit(self):
+        pager = OutputPager(max_lines=0, max_chars=10)
+        self.assertEqual(self.page(pager, 'abcd\n', 'efgh\n', 'ijkl\n'),
+                         'abcd\nefgh\n... 1 more line')
+        self.assertEqual(pager.pending, 1)
+        self.assertFalse(pager.show_more())
+        self.assertTrue(self.written().endswith('ijkl\n'))
+
+    def test_escape_sequences(self):
+        # They take no room, and aren't cut.
+        pager = OutputPager(max_lines=1)
+        text = '\x1b[31m' + 'a' * 20 + '\x1b[0m\n'
+        self.assertEqual(self.page(pager, text, 'b\n'),
+                         text + '... 1 more line')
+        pager = OutputPager(max_lines=0, max_chars=4)
+        self.assertTrue(self.page(pager, 'ab\x1b[31mcd\n').startswith(
+            'ab...'))
+
+    def test_drop(self):
+        pager = OutputPager(max_lines=1)
+        self.page(pager, 'a\nb\nc\n')
+        self.assertEqual(pager.pending, 2)
+        pager.drop()
+        self.assertEqual(pager.pending, 0)
+        self.assertFalse(pager.overflowing)
+        self.assertFalse(pager.show_more())
+        self.assertEqual(self.written(), '')
+        # Capturing again starts from scratch.
+        self.assertEqual(self.page(pager, 'd\n'), 'd\n')
+        self.assertEqual(pager.pending, 0)
+
+    def test_standard_error(self):
+        pager = OutputPager(max_lines=2)
+        with pager.capture():
+            sys.stdout.write('a\n')
+            sys.stderr.write('b\n')
+            sys.stderr.write('c\n')
+        self.assertEqual(self.written(), 'a\nb\n... 1 more line')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+import ast
+import codeop
+import os
+import random
+import sys
+import tempfile
+import time
+import unittest
+
+from autopython import parser
+
+# Pieces of scripts joined at random to compare the splitters.
+FRAGMENTS = [
+    'x = 1\n', 'x = 1; y = 2\n', 'if 1: pass\n',
+    'for i in range(3): print(i)\n', 'def g(): pass\n', '# c\n', '#c\n',
+    '\n', '    # indented\n', 'if x:\n    y = 2\n',
+    'if x:\n    y = 2\nelse:\n    y = 3\n',
+    'def f(a):\n    return a\n', 'class C:\n    n = 1\n',
+    'd = {\n  1: 2,\n  # inside\n  3: 4}\n', 's = """a\n\nb"""\n',
+    'try:\n    pass\nexcept E:\n    pass\n', 'if 1: pass\nelse: pass\n',
+    'with a: b\n', '@dec\ndef h(): pass\n', 'while 0:\n    pass\n\n',
+    'x = (1 +\n     2)\n', 'print("hi")\n', '  bad indent\n',
+    'for x in y: return x\n', 'def f(a, a): pass\n', 'if 1:\n    return 5\n',
+    'x = \\\n  3\n', 'if 1:\n    if 2: pass\n    # c\n', ')\n', 'x = [\n',
+    'elif x:\n', 'f(a=1, a=2)\n', 'def f(a, b, a):\n    return a\n',
+    'class D:\n    def m(self): return 1\n    return 2\n',
+    'class D:\n    def m(self):\n        return 1\n',
+]
+
+REGRESSIONS = [
+    'if 1: pass\n# c\n\nx = 1\n',
+    'x = 1; y = 2\nfor i in range(3): print(i)\n#c\n# c\ndef g(): pass\n',
+    'for x in y: return x\n# c\nprint("hi")\n',
+    'def f(a, a): pass\n# comment\nx = 1\n',
+    'if 1:\n    return 5\n\nx = 1\n',
+    'if 1:\n    return 5\nelif x:\n',
+]
+
+
+def baseline_split(source_lines):
+    # How statements were split compiling the pending statement after every
+    # line, as the interactive shell does.
+    compiler = codeop.CommandCompiler()
+    statements = []
+    statement = ''
+    prompts = []
+    statement_started = False
+    statement_first_line = statement_current_line = -1
+    statement_line_number = line_number = 0
+
+    for line in source_lines:
+        line_number += 1
+        statement_current_line += 1
+
+        prompts.append('ps2' if statement_started else 'ps1')
+        statement += line
+
+        is_empty_line = line.strip() == ''
+        statement_started = statement_started or not is_empty_line
+
+        if statement_first_line == -1:
+            if line.startswith('#'):
+                continue
+            elif is_empty_line:
+                statement_started = False
+                continue
+            else:
+                statement_first_line = statement_current_line
+                statement_line_number = line_number
+
+        code, compiled = parser.compile_statement(compiler, statement)
+        if compiled:
+            statements.append((statement_line_number, statement, prompts,
+                               statement_first_line, code is None))
+            statement_started = False
+            statement_current_line = statement_first_line = -1
+            statement = ''
+            prompts = []
+
+    if statement:
+        if prompts[-1] == 'ps2':
+            statement += '\n'
+            prompts.append('ps2')
+        code, compiled = parser.compile_statement(compiler, statement)
+        statements.append((statement_line_number, statement, prompts,
+                           statement_first_line, code is None))
+    return statements
+
+
+def split(source_lines):
+    return [(info.line_number, info.statement, info.prompts, info.first_line,
+             info.code is None)
+            for info in parser.split_statements(source_lines)]
+
+
+def checked_split(source_lines):
+    return [record[:4] + (record[4] is None,)
+            for record in parser.iter_checked_statements(source_lines)]
+
+
+def compiled_split(source_lines):
+    return [record[:4] + (record[4] is None,)
+            for record in parser.iter_statements(source_lines)]
+
+
+def source_lines(source):
+    lines = parser.LINE_RE.findall(source.rstrip() + '\n')
+    return parser.strip_encoding_declaration(lines)[0]
+
+
+class SplitStatementsTest(unittest.TestCase):
+    def assert_same_split(self, source):
+        lines = source_lines(source)
+        self.assertEqual(split(lines), baseline_split(lines), source)
+
+    def test_regressions(self):
+        for source in REGRESSIONS:
+            self.assert_same_split(source)
+
+    def test_random_scripts(self):
+        rng = random.Random(0)
+        for _ in range(3000):
+            self.assert_same_split(''.join(
+                rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 8))))
+
+
+class CheckedStatementsTest(unittest.TestCase):
+    # Only checking the syntax must split statements like compiling them.
+    def assert_same_split(self, source):
+        lines = source_lines(source)
+        self.assertEqual(checked_split(lines), compiled_split(lines), source)
+
+    def test_regressions(self):
+        for source in REGRESSIONS:
+            self.assert_same_split(source)
+
+    def test_random_scripts(self):
+        rng = random.Random(0)
+        for _ in range(3000):
+            self.assert_same_split(''.join(
+                rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 8))))
+
+    def test_future_flags(self):
+        lines = source_lines('from __future__ import division\n'
+                             'from __future__ import annotations\n'
+                             'x = 1 / 2\n')
+        self.assertEqual(
+            [record[5] for record in parser.iter_checked_statements(lines)],
+            [record[5] for record in parser.iter_statements(lines)])
+
+    def test_compiled_when_needed(self):
+        # Loading lazily only parses the statements, unless their errors
+        # may only be found compiling them.
+        compiled = []
+
+        def compile_code(source, filename, symbol, flags=0, *args):
+            if not flags & ast.PyCF_ONLY_AST:
+                compiled.append(type(source.body[0]).__name__)
+            return compile(source, filename, symbol, flags, *args)
+
+        lines = source_lines(many_statements(30) +
+                             'class C(object):\n    def m(self):\n'
+                             '        return 1\n\nreturn 2\n')
+        parser.compile = compile_code
+        try:
+            table = parser.parse_source_lines(lines, code_cache_size=8)
+        finally:
+            del parser.compile
+        self.assertEqual(set(compiled), set(['Return']))
+        self.assertEqual([info.code is None for info in table],
+                         [False] * 31 + [True])
+
+
+def table_rows(table):
+    return [(info.line_number, info.statement, info.first_line,
+             info.code is None) for info in table]
+
+
+class ReparseFileTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.py')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def parse(self, lines, code_cache_size):
+        with open(self.filename, 'w') as script:
+            script.write(''.join(lines))
+        return parser.parse_file(self.filename,
+                                 code_cache_size=code_cache_size)
+
+    def test_random_edits(self):
+        # Changing lines here and there, the statements reparsed must be
+        # the ones parsing the whole script again.
+        edits = sorted(set(line for fragment in FRAGMENTS
+                           for line in fragment.splitlines(True)))
+        rng = random.Random(0)
+        for attempt in range(600):
+            code_cache_size = 8 if attempt % 2 else None
+            lines = ''.join(rng.choice(FRAGMENTS) for _ in range(
+                rng.randint(1, 8))).splitlines(True)
+            try:
+                table = self.parse(lines, code_cache_size)
+            except SyntaxError:
+                continue
+            for _ in range(rng.randint(1, 2)):
+                index = rng.randrange(len(lines) + 1)
+                if index == len(lines) or rng.random() < 0.4:
+                    lines.insert(index, rng.choice(edits))
+                elif rng.random() < 0.5:
+                    del lines[index]
+                else:
+                    lines[index] = rng.choice(edits)
+            try:
+                expected = self.parse(lines, code_cache_size)
+            except SyntaxError:
+                continue
+            parser.reparse_file(self.filename, table)
+            self.assertEqual(table_rows(table), table_rows(expected),
+                             ''.join(lines))
+
+    def test_changed_range(self):
+        lines = ['x{} = {}\n'.format(index, index) for index in range(10)]
+        for code_cache_size in (None, 8):
+            table = self.parse(lines, code_cache_size)
+            self.parse(lines[:4] + ['x4 = 40\n'] + lines[5:], None)
+            self.assertEqual(parser.reparse_file(self.filename, table),
+                             (4, 5, 5))
+            self.parse(lines[:4] + ['x4 = 40\n', 'y = 4\n'] + lines[5:], None)
+            self.assertEqual(parser.reparse_file(self.filename, table),
+                             (5, 5, 6))
+
+
+def many_statements(count):
+    return ''.join(
+        'def f{0}(a, b=2):\n    return [x * b for x in range(a)]\n\n'
+        'x{0} = f{0}(3)\nprint(x{0})\n'.format(index)
+        for index in range(count // 3))
+
+
+def parse_time(lines, jobs):
+    # The best of a few attempts, to leave out other processes.
+    times = []
+    for _ in range(3):
+        start = time.time()
+        parser.parse_source_lines(lines, jobs=jobs)
+        times.append(time.time() - start)
+    return min(times)
+
+
+class ParseJobsTest(unittest.TestCase):
+    def test_same_statements(self):
+        lines = source_lines(many_statements(300) + 'return 1\nf(a=1, a=2)\n')
+        self.assertEqual(table_rows(parser.parse_source_lines(lines, jobs=4)),
+                         table_rows(parser.parse_source_lines(lines)))
+
+    def test_not_slower(self):
+        lines = source_lines(many_statements(3000))
+        self.assertLess(parse_time(lines, 4), parse_time(lines, 1) * 1.25)
+
+
+class _AsciiStream(object):
+    encoding = 'ascii'
+
+
+class DecodeSourceTest(unittest.TestCase):
+    def test_first_error_reported(self):
+        # The unprintable character comes before the undecodable byte, in
+        # the same chunk.
+        source = b'x = 1\ny = "\xc3\xa9"\nz = "\xff"\n'
+        stdout = sys.stdout
+        sys.stdout = _AsciiStream()
+        try:
+            with self.assertRaises(SyntaxError) as context:
+                parser.decode_source(source)
+        finally:
+            sys.stdout = stdout
+        self.assertIn('line 2,', str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import os
+import select
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+try:
+    import pty
+except ImportError:
+    pty = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = 'x = 1\nprint(x + 1)\ny = 3\n'
+
+
+def read_output(fd, seconds):
+    output = b''
+    end = time.time() + seconds
+    while time.time() < end:
+        if not select.select([fd], [], [], 0.05)[0]:
+            continue
+        try:
+            data = os.read(fd, 65536)
+        except OSError:
+            break
+        if not data:
+            break
+        output += data
+    return output
+
+
+def present(script, options, keys):
+    # Runs the presenter in a terminal, pressing the keys one at a time.
+    pid, fd = pty.fork()
+    if pid == 0:
+        env = dict(os.environ, PYTHONPATH=ROOT, TERM='xterm')
+        args = [sys.executable, '-m', 'autopython', '--no-log',
+                '--no-cache', '--no-highlight'] + options + [script]
+        os.execve(sys.executable, args, env)
+    try:
+        output = read_output(fd, 1.0)
+        for key in keys:
+            os.write(fd, key)
+            output += read_output(fd, 0.5)
+    finally:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+        os.close(fd)
+    return output.decode('utf-8', 'replace')
+
+
+@unittest.skipIf(pty is None, 'pty is missing')
+class CheckpointsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.script = os.path.join(self.directory, 'script.py')
+        with open(self.script, 'w') as script:
+            script.write(SCRIPT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_checkpoints_with_worker(self):
+        # Without forking the shell there are no checkpoints to take.
+        output = present(self.script, ['--checkpoints', '1', '--worker'],
+                         [b'n'] * 4)
+        self.assertNotIn('Traceback', output)
+        self.assertIn('print(x + 1)\r\n2\r\n', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from autopython import parser
+from autopython.replay import ReplayPlanner, analyze
+
+
+def make_table(statements):
+    source_lines = [line for statement in statements
+                    for line in parser.LINE_RE.findall(statement)]
+    table = parser.StatementTable(source_lines)
+    table.fill(parser.iter_statements(source_lines))
+    return table
+
+
+def plan(statements, end):
+    needed = ReplayPlanner().plan(make_table(statements), 0, end)
+    return needed if needed is None else sorted(needed)
+
+
+class ReplayPlannerTest(unittest.TestCase):
+    def test_unused_statements_left_out(self):
+        self.assertEqual(plan(['x = 1\n', 'y = 2\n', 'print(x)\n',
+                               'z = x + 1\n', 'z\n'], 4), [0, 3])
+
+    def test_changes_through_other_variables(self):
+        self.assertEqual(plan(['a = [1, 2, 3]\n', 'b = a\n',
+                               'b.append(4)\n', 'a\n'], 3), [0, 1, 2])
+        self.assertEqual(plan(['class C: pass\n\n', 'c = C()\n', 'd = c\n',
+                               'd.n = 5\n', 'c.n\n'], 4), [0, 1, 2, 3])
+        self.assertEqual(plan(['i = 0\n', 'i += 1\n', 'print(i)\n'], 2),
+                         [0, 1])
+
+    def test_variables_used_by_functions(self):
+        self.assertEqual(plan(['def area(r): return PI * r ** 2\n\n',
+                               'PI = 3.14159\n', 'area(2)\n'], 2), [0, 1])
+        self.assertEqual(plan(['PI = 3\n', 'g = (x * PI for x in [1])\n',
+                               'PI = 4\n', 'list(g)\n'], 3), [0, 1, 2])
+
+    def test_calls_run_now(self):
+        self.assertEqual(plan(['def f(x=g()): pass\n\n', 'y = 1\n', 'f\n'], 2),
+                         [0])
+        self.assertEqual(plan(['def key(x): return x\n\n', 'out = []\n',
+                               'sorted([1], key=key)\n', 'out\n'], 3),
+                         [0, 1, 2])
+
+    def test_code_run_defining(self):
+        self.assertEqual(plan(['handlers = []\n',
+                               'def register(f): handlers.append(f); '
+                               'return f\n\n',
+                               '@register\ndef h(): pass\n\n', 'x = 1\n',
+                               'handlers\n'], 4), [0, 1, 2])
+        self.assertEqual(plan(['handlers = []\n',
+                               'class Base(object):\n'
+                               '    def __init_subclass__(cls):\n'
+                               '        handlers.append(cls)\n\n',
+                               'class C(Base): pass\n\n', 'x = 1\n',
+                               'handlers\n'], 4), [0, 1, 2])
+
+    def test_opaque_statements(self):
+        self.assertIsNone(plan(['x = 1\n', 'exec("y = x")\n', 'y\n'], 2))
+        self.assertIsNone(analyze('from os import *\n'))
+
+    def test_reading_calls(self):
+        self.assertFalse(analyze('print(x, end="")\n').impure)
+        self.assertTrue(analyze('print(x, file=f)\n').impure)
+        self.assertTrue(analyze('x.sort()\n').impure)
+
+    def test_uses_through_functions(self):
+        planner = ReplayPlanner()
+        table = make_table(['def ask():\n    return input()\n\n',
+                            'def greet():\n    return ask().title()\n\n',
+                            'name = greet()\n',
+                            'line = sys.stdin.readline()\n', 'x = 1\n',
+                            'exec("x = 2")\n'])
+        uses = [planner.uses_any(table, index, ['input', 'sys.stdin'])
+                for index in range(len(table))]
+        self.assertEqual(uses, [False, False, True, True, False, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
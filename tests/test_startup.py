@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported only when highlighting or an interactive session is used.
+LAZY_MODULES = ('pygments', 'colorama', 'IPython', 'readline', 'rlcompleter',
+                'multiprocessing')
+
+# Import time allowed to autopython (in microseconds), about twice what it
+# takes now, which is less than it took importing everything eagerly.
+IMPORT_TIME_BUDGET = 120000
+
+SHOW_VERSION = '''
+import runpy, sys
+sys.argv = ['autopython', '--version']
+try:
+    runpy.run_module('autopython', run_name='__main__')
+except SystemExit:
+    pass
+'''
+
+NO_HIGHLIGHTING = '''
+from autopython.cpython import PresenterShell
+PresenterShell(color_scheme=None)
+'''
+
+PRINT_MODULES = '''
+import sys
+sys.stderr.write(' '.join(sys.modules) + '\\n')
+'''
+
+
+def run_python(code, *options):
+    process = subprocess.Popen(
+        (sys.executable,) + options + ('-c', code), cwd=ROOT,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, errors = process.communicate()
+    return process.returncode, errors.decode('utf-8', 'replace')
+
+
+class StartupTest(unittest.TestCase):
+    def assert_lazy(self, code):
+        returncode, errors = run_python(code + PRINT_MODULES)
+        self.assertEqual(returncode, 0, errors)
+        modules = errors.split()
+        for name in LAZY_MODULES:
+            imported = [module for module in modules
+                        if module == name or module.startswith(name + '.')]
+            self.assertEqual(imported, [], code)
+
+    def test_version_imports_no_highlighting(self):
+        self.assert_lazy(SHOW_VERSION)
+
+    def test_no_highlighting_imports_no_pygments(self):
+        self.assert_lazy(NO_HIGHLIGHTING)
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime is missing')
+    def test_import_time_budget(self):
+        returncode, errors = run_python(SHOW_VERSION, '-X', 'importtime')
+        self.assertEqual(returncode, 0, errors)
+        match = re.search(r'\|\s*(\d+) \| autopython$', errors, re.M)
+        self.assertIsNotNone(match, errors)
+        self.assertLess(int(match.group(1)), IMPORT_TIME_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()